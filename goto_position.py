@@ -2,21 +2,67 @@ import localizer
 from localization.monte_carlo import OccupationMap
 import pathfinding
 import math
+import threading
 
 class GotoPosition:
     def __init__(self, robot, start_position=(0, 0, 0), localization_interval=10):
         self.robot = robot
         self.map=robot.map
+        self.graphMap = robot.graph_map
         self.occupation_map = OccupationMap.from_Map(self.map)
-        self.graphMap = pathfinding.GraphMap(self.map)
+        unreachable = self.graphMap.unreachable_seats()
+        if unreachable:
+            print(f"Seats {[seat.id for seat in unreachable]} can not be reached, check the map.")
+        # incremental planner of the current goto, repairs its path when the robot moves or obstacles change,
+        # None when going to a seat
+        self.planner = None
+        # flow fields towards the seats, the path to a seat is read off without any search
+        self.flow_fields = robot.flow_fields
+        self.lock = threading.Lock()
         self.localizer = localizer.Localizer(robot.ep_robot, Map=self.occupation_map, position=start_position, num_particles=10, movement_perturbation=0, rotation_perturbation=0, perturbation_uniform=True, update_steps=0)
         self.current_position = start_position
         self.current_rotation = 0
         self.localization_interval = localization_interval
         
 
+    def add_obstacle(self, obstacle):
+        """Add a (temporary) obstacle while the robot may be underway."""
+        with self.lock:
+            self.graphMap.add_obstacle(obstacle)
+
+    def remove_obstacle(self, obstacle):
+        with self.lock:
+            self.graphMap.remove_obstacle(obstacle)
+
+    def move_obstacle(self, obstacle, x, y):
+        with self.lock:
+            self.graphMap.move_obstacle(obstacle, x, y)
+
+    def _plan(self, goal):
+        """Path from the current position to goal or None (goal unreachable or position outside of the map),
+        must be called with the lock held."""
+        try:
+            if self.planner is None:
+                return self.flow_fields.path_from_to(self.current_position, goal)
+            self.planner.move_to(self.current_position)
+            return self.planner.path()
+        except (ValueError, KeyError):
+            return None
+
     def goto(self, x, y):
-        path = self.graphMap.path_from_to(self.current_position, (x,y))
+        with self.lock:
+            try:
+                reachable = self.graphMap.connected(self.current_position, (x, y))
+            except KeyError:
+                reachable = False
+            if not reachable:
+                print("No path found to the target position.")
+                return False
+            if any((seat.x, seat.y) == (x, y) for seat in self.map.seats):
+                self.planner = None
+            else:
+                self.planner = pathfinding.DStarLite(self.graphMap, self.current_position, (x, y))
+            path = self._plan((x, y))
 
         if path is None:
             print("No path found to the target position.")
@@ -25,20 +71,23 @@ class GotoPosition:
             #repeat 3 steps until the robot is close enough to the target position
             while abs(self.current_position[0]-x)+abs(self.current_position[1]-y) > 1:
                 print("starting goto with path")
-                #replan the whole path
-                path = self.graphMap.path_from_to(self.current_position, (x, y))
-
-                instructions = self.graphMap.instructions_from_path(path)
-
+                #repair the path from the new position
+                with self.lock:
+                    path = self._plan((x, y))
+                if path is None:
+                    # goal blocked on the way (new obstacle) or the robot was localized off the free space
+                    self.robot.stop()
+                    print("No path found to the target position.")
+                    return False
 
-                #only perfrom the first n instructions to avoid too long paths
-                instructions=instructions[:self.localization_interval]
-                self.robot.resolve_path(instructions)
+                #only drive the first n cells to avoid too long paths, merged into a few straight moves
+                instructions = self.graphMap.instructions_from_path(path[:self.localization_interval + 1], compress=True)
+                self.robot.resolve_path_holonomic(instructions)
                 
-                #then do one localization step
+                #then do one localization step, the chassis does not rotate while driving
                 delta_x = sum([inst[0] for inst in instructions])
                 delta_y = sum([inst[1] for inst in instructions])
-                delta_rotation = self.current_rotation- math.atan2(instructions[-1][1], instructions[-1][0])
+                delta_rotation = 0
                 print("old_poition",self.current_position, (delta_x, delta_y, delta_rotation))
                 n_x,n_y,n_r= self.localizer.step(delta_x, delta_y, delta_rotation)
 
@@ -24,7 +24,7 @@ class Particle:
         return new_particle
 
 class OccupationMap:
-    def __init__(self, boundary_points=None, obstacles=None):
+    def __init__(self, boundary_points=None, obstacles=None, grid_map=None, robot_radius=0.0):
         # Outer wall (rectangle: xmin, ymin, xmax, ymax)
         self.boundary = Polygon(boundary_points) if boundary_points else Polygon([(0, 0), (100, 0), (100, 100), (0, 100)])
         self.width = self.boundary.bounds[2] - self.boundary.bounds[0]
@@ -32,6 +32,12 @@ class OccupationMap:
         
         # List of obstacle polygons
         self.obstacles = [Polygon(obs) for obs in obstacles] if obstacles else []
+        
+        # pathfinding.Map this map was created from, its rasters answer in_obstacle queries and
+        # positions closer than robot_radius to an obstacle or the boundary count as blocked. The
+        # boundary is the one the rays are cast against, [0, width] x [0, height]
+        self.grid_map = grid_map
+        self.robot_radius = robot_radius
 
     def distance_to_nearest_obstacle(self, x, y, r, max_distance=100.00):
         # Cast a ray from (x, y) in direction r
@@ -64,9 +70,41 @@ class OccupationMap:
         return scan
     
     def in_obstacle(self, x, y):
+        if self.grid_map is not None:
+            return bool(self._blocked_many(x, y))
         point = Point(x, y)
         return any(obs.contains(point) for obs in self.obstacles) or not self.boundary.contains(point)
     
+    def in_obstacle_many(self, xs, ys):
+        """ Vectorized in_obstacle, returns a boolean array """
+        if self.grid_map is not None:
+            return self._blocked_many(xs, ys)
+        return np.array([self.in_obstacle(x, y) for x, y in zip(xs, ys)], dtype=bool)
+    
+    def _blocked_many(self, xs, ys):
+        """ Points not inside the boundary (shrunk by robot_radius), inside an obstacle of grid_map or closer
+        than robot_radius to one. Like the shapely test without grid_map, points on the boundary are
+        blocked and points on the edge of an obstacle are not. The clearance raster of the Map is not
+        used since it measures the distance to the map border at width - 1 instead of the boundary at width """
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        shape, xs, ys = xs.shape, xs.ravel(), ys.ravel()
+        xmin, ymin, xmax, ymax = self.boundary.bounds
+        r = self.robot_radius
+        blocked = (xs <= xmin + r) | (xs >= xmax - r) | (ys <= ymin + r) | (ys >= ymax - r)
+        b = self.grid_map.obstacle_bounds()
+        # the raster test of the Map counts the edges of the obstacles as inside, its hits are
+        # checked again against the open rectangles
+        hits = self.grid_map.in_obstacle_many(xs, ys) & ~blocked
+        if hits.any():
+            px, py = xs[hits][:, None], ys[hits][:, None]
+            blocked[hits] = ((px > b[:, 0]) & (px < b[:, 2]) & (py > b[:, 1]) & (py < b[:, 3])).any(axis=1)
+        if r > 0:
+            px, py = xs[..., None], ys[..., None]
+            dx = np.maximum(np.maximum(b[:, 0] - px, px - b[:, 2]), 0)
+            dy = np.maximum(np.maximum(b[:, 1] - py, py - b[:, 3]), 0)
+            blocked |= (np.hypot(dx, dy) < r).any(axis=-1)
+        return blocked.reshape(shape)
+    
     def plot(self, ax=None):
         if ax is None:
             fig, ax = plt.subplots(figsize=(6, 6))
@@ -96,14 +134,14 @@ class OccupationMap:
             scan_data.append(distance)
         return scan_data
     
-    def from_Map(map_obj):
-        """ Convert a Map object to an OccupationMap """
+    def from_Map(map_obj, robot_radius=0.0):
+        """ Convert a Map object to an OccupationMap, in_obstacle uses the rasters of the Map """
         boundary_points = [(0, 0), (map_obj.width, 0), (map_obj.width, map_obj.height), (0, map_obj.height)]
         obstacles = []
         for obs in map_obj.obstacles:
             obstacles.append([(obs.x, obs.y), (obs.x + obs.width, obs.y), 
                               (obs.x + obs.width, obs.y + obs.height), (obs.x, obs.y + obs.height)])
-        return OccupationMap(boundary_points=boundary_points, obstacles=obstacles)
+        return OccupationMap(boundary_points=boundary_points, obstacles=obstacles, grid_map=map_obj, robot_radius=robot_radius)
 
 
 class MonteCarloLocalization:
@@ -148,11 +186,14 @@ class MonteCarloLocalization:
             
             error.append(MSE_p)
         inverted_error = [1/(e + 1e-6) for e in error]  # Avoid division by zero
+        
+        # particles in obstacles are impossible, unless all of them are
+        blocked = self.occupation_map.in_obstacle_many([p.x for p in self.particles], [p.y for p in self.particles])
+        if not blocked.all():
+            inverted_error = [0 if b else e for e, b in zip(inverted_error, blocked)]
         sum_error = sum(inverted_error)
 
         for i in range(len(self.particles)):
-            if self.occupation_map.in_obstacle(self.particles[i].x, self.particles[i].y):
-                self.particles[i].probability = 0
             self.particles[i].probability = inverted_error[i] / sum_error if sum_error > 0 else 1
         
          
@@ -5,7 +5,7 @@ import localization.plot as plot
 from localization.monte_carlo import OccupationMap, MonteCarloLocalization
 
 import localization.monte_carlo
-from pathfinding import Map, Obstacle
+from pathfinding import Map, Obstacle, load_compiled_map
 num_particles = 100
 
 
@@ -16,6 +16,8 @@ scan= scan[::-1]
 # print(len(scan))
 o1 = Obstacle(10, 0, 4, 4)
 map = Map(22, 14, [o1], [])
+# rasters of the map from the compiled bundle
+load_compiled_map(map)
 
 
 occ= localization.monte_carlo.OccupationMap.from_Map(map)
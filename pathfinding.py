@@ -1,9 +1,84 @@
 import numpy as np
 import matplotlib.pyplot as plt
+import scipy.sparse as sp
 import scipy.sparse.csgraph as csg
+from scipy import ndimage
+from scipy.spatial import cKDTree
 import math
+import heapq
+import hashlib
+import json
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
 from matplotlib.patches import Rectangle
+from multiprocessing import shared_memory
 import random
+import threading
+import time
+
+# calibration of the robot motion at speed 50, see RobotManager.move_distance and rotate_angle
+CELL_SIZE_CM = 10
+SECONDS_PER_DEGREE = 0.0135
+SECONDS_PER_CM = {"forward": 0.04, "backward": 0.0355, "left": 0.057, "right": 0.0376}
+
+
+def strafe_times(forward, left):
+    """ Seconds the forward and the sideways part of a move (in cm, robot frame) take on their own """
+    t_forward = abs(forward) * SECONDS_PER_CM["forward" if forward >= 0 else "backward"]
+    t_left = abs(left) * SECONDS_PER_CM["left" if left >= 0 else "right"]
+    return t_forward, t_left
+
+
+def estimate_execution_time(instructions, heading=0, holonomic=False):
+    """ Predicted seconds the robot needs to drive the (dx, dy) instructions.
+    
+    heading is the initial heading of the robot in degrees counterclockwise from the x axis
+    (RobotManager.current_angle counts clockwise, so heading = -current_angle). By default the
+    instructions are driven like RobotManager.resolve_path: turn towards the move, then drive forward.
+    With holonomic they are driven like RobotManager.resolve_path_holonomic without turning.
+    """
+    total = 0.0
+    for dx, dy in instructions:
+        if dx == 0 and dy == 0:
+            continue
+        if holonomic:
+            angle = math.radians(heading)
+            forward = (dx * math.cos(angle) + dy * math.sin(angle)) * CELL_SIZE_CM
+            left = (-dx * math.sin(angle) + dy * math.cos(angle)) * CELL_SIZE_CM
+            total += max(strafe_times(forward, left))
+        else:
+            target = math.degrees(math.atan2(dy, dx))
+            total += abs((target - heading + 180) % 360 - 180) * SECONDS_PER_DEGREE
+            total += math.hypot(dx, dy) * CELL_SIZE_CM * SECONDS_PER_CM["forward"]
+            heading = target
+    return total
+
+
+def segments_in_rectangles(x1, y1, x2, y2, bounds):
+    """ Vectorized test whether the segments (x1, y1) -> (x2, y2) touch any of the closed rectangles (rows xmin, ymin, xmax, ymax)
+
+    Slab method: per axis the parameter interval t in which the segment lies between the two
+    sides of a rectangle is computed, the segment hits the rectangle if the intervals of both
+    axes overlap within [0, 1]. Evaluated for all segments against all rectangles at once.
+    """
+    x1, y1, x2, y2 = (np.asarray(a, dtype=float)[..., None] for a in (x1, y1, x2, y2))
+    shape = np.broadcast_shapes(x1.shape, y1.shape, x2.shape, y2.shape)[:-1]
+    if len(bounds) == 0 or 0 in shape:
+        return np.zeros(shape, dtype=bool)
+    t_enter, t_exit = 0.0, 1.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q, lo, hi in ((x1, x2, bounds[:, 0], bounds[:, 2]), (y1, y2, bounds[:, 1], bounds[:, 3])):
+            d = q - p
+            t_lo = (lo - p) / d
+            t_hi = (hi - p) / d
+            # for segments parallel to the sides the division gives -inf / inf if the segment is
+            # between the sides and inf / inf or -inf / -inf if not, nan means it lies on a side
+            t_lo[np.isnan(t_lo)] = -np.inf
+            t_hi[np.isnan(t_hi)] = np.inf
+            t_enter = np.maximum(t_enter, np.minimum(t_lo, t_hi))
+            t_exit = np.minimum(t_exit, np.maximum(t_lo, t_hi))
+    return np.broadcast_to((t_enter <= t_exit).any(axis=-1), shape)
 
 
 class Obstacle:
@@ -29,24 +104,260 @@ class Map:
     
     """Map defined by the grid [0, width - 1] x [0, heigth - 1]"""
     
-    def __init__(self, width, height, obstacles: list, seats: list):
+    # states of the cells of the occupancy raster
+    FREE, MIXED, OCCUPIED = 0, 1, 2
+    
+    def __init__(self, width, height, obstacles: list, seats: list, resolution=4):
         self.width = width
         self.height = height
-        self.obstacles = obstacles
         self.seats = seats
+        # number of raster cells per map unit used by in_obstacle / in_obstacle_many
+        self.resolution = resolution
+        self.version = 0
+        self.obstacles = obstacles
+    
+    @property
+    def obstacles(self):
+        return self._obstacles
+    
+    @obstacles.setter
+    def obstacles(self, obstacles):
+        self._obstacles = obstacles
+        self.invalidate()
+    
+    def invalidate(self):
+        """ Mark the map as changed, derived data (occupancy raster, graphs, ...) is rebuilt on next use.
+        
+        Has to be called after modifying the obstacle list in place.
+        """
+        self.version += 1
+        self._raster = None
+        self._clearance = None
+        self._obstacle_bounds = None
+    
+    def set_rasters(self, raster, clearance):
+        """ Use prebuilt occupancy and clearance rasters (e.g. of a compiled map) for the current obstacles """
+        r = self.resolution
+        if (raster.shape != (int(self.width * r) + 1, int(self.height * r) + 1)
+                or clearance.shape != (int((self.width - 1) * r), int((self.height - 1) * r))):
+            raise ValueError(f"Rasters of shape {raster.shape} and {clearance.shape} do not fit the map")
+        self._raster = raster
+        self._clearance = clearance
+    
+    def add_obstacle(self, obstacle):
+        self._obstacles.append(obstacle)
+        self.invalidate()
+    
+    def remove_obstacle(self, obstacle):
+        self._obstacles.remove(obstacle)
+        self.invalidate()
         
     def get_seats(self):
         return self.seats
+    
+    def obstacle_bounds(self):
+        """ Array of the obstacle rectangles as rows (xmin, ymin, xmax, ymax) """
+        if self._obstacle_bounds is None:
+            bounds = np.array([(o.x, o.y, o.x + o.width, o.y + o.height) for o in self._obstacles], dtype=float)
+            self._obstacle_bounds = bounds.reshape(-1, 4)
+        return self._obstacle_bounds
+    
+    def occupancy_raster(self):
+        """ Raster over [0, width] x [0, height] with `resolution` cells per unit, indexed [i, j].
+        
+        Cell [i, j] covers [i / resolution, (i + 1) / resolution) x [j / resolution, (j + 1) / resolution)
+        and is OCCUPIED if it lies completely inside an obstacle, FREE if it does not touch any
+        obstacle and MIXED otherwise. Built once per map version.
+        """
+        if self._raster is None:
+            r = self.resolution
+            raster = np.full((int(self.width * r) + 1, int(self.height * r) + 1), self.FREE, dtype=np.int8)
+            nx, ny = raster.shape
+            for o in self._obstacles:
+                # cells touching the closed rectangle
+                i0, i1 = max(math.floor(o.x * r), 0), min(math.floor((o.x + o.width) * r), nx - 1)
+                j0, j1 = max(math.floor(o.y * r), 0), min(math.floor((o.y + o.height) * r), ny - 1)
+                if i0 <= i1 and j0 <= j1:
+                    block = raster[i0:i1 + 1, j0:j1 + 1]
+                    np.maximum(block, self.MIXED, out=block)
+                # cells completely covered by the rectangle
+                i0, i1 = max(math.ceil(o.x * r), 0), min(math.floor((o.x + o.width) * r) - 1, nx - 1)
+                j0, j1 = max(math.ceil(o.y * r), 0), min(math.floor((o.y + o.height) * r) - 1, ny - 1)
+                if i0 <= i1 and j0 <= j1:
+                    raster[i0:i1 + 1, j0:j1 + 1] = self.OCCUPIED
+            self._raster = raster
+        return self._raster
         
     def in_obstacle(self, x, y):
-        for o in self.obstacles:
+        raster = self.occupancy_raster()
+        i = math.floor(x * self.resolution)
+        j = math.floor(y * self.resolution)
+        if 0 <= i < raster.shape[0] and 0 <= j < raster.shape[1]:
+            state = raster[i, j]
+            if state != self.MIXED:
+                return state == self.OCCUPIED
+        # cell on an obstacle border or outside of the raster: exact check
+        for o in self._obstacles:
             if o.is_inside(x, y):
                 return True
         return False
     
+    def in_obstacle_many(self, xs, ys):
+        """ Vectorized in_obstacle, returns a boolean array with the shape of xs and ys """
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        # flat copies, so scalars become arrays that can be assigned to by mask
+        shape, xs, ys = xs.shape, xs.ravel(), ys.ravel()
+        raster = self.occupancy_raster()
+        i = np.floor(xs * self.resolution)
+        j = np.floor(ys * self.resolution)
+        inside = (i >= 0) & (i < raster.shape[0]) & (j >= 0) & (j < raster.shape[1])
+        state = np.full(xs.shape, self.MIXED, dtype=np.int8)
+        state[inside] = raster[i[inside].astype(np.intp), j[inside].astype(np.intp)]
+        result = state == self.OCCUPIED
+        
+        exact = state == self.MIXED
+        if exact.any():
+            b = self.obstacle_bounds()
+            px, py = xs[exact][:, None], ys[exact][:, None]
+            result[exact] = ((px >= b[:, 0]) & (px <= b[:, 2]) & (py >= b[:, 1]) & (py <= b[:, 3])).any(axis=1)
+        return result.reshape(shape)
+    
+    def clearance(self):
+        """ Raster (float32, cells as in occupancy_raster) of the distance from each cell to the nearest obstacle or map border.
+        
+        Computed with a Euclidean distance transform over the occupancy raster once per map version. Cells
+        touching an obstacle and cells beyond the map have clearance 0. The distance between cell centers is
+        reduced by one cell diagonal, so the value is a lower bound for every point of the cell.
+        """
+        if self._clearance is None:
+            r = self.resolution
+            nx, ny = int((self.width - 1) * r), int((self.height - 1) * r)
+            # cells inside the map surrounded by a border of blocked cells (the walls)
+            free = np.zeros((nx + 2, ny + 2), dtype=bool)
+            free[1:-1, 1:-1] = self.occupancy_raster()[:nx, :ny] == self.FREE
+            dist = ndimage.distance_transform_edt(free, sampling=1 / r)[1:-1, 1:-1]
+            self._clearance = np.maximum(dist - math.sqrt(2) / r, 0).astype(np.float32)
+        return self._clearance
+    
+    def clearance_many(self, xs, ys):
+        """ Vectorized lookup of the clearance raster at the points, 0 outside of the map """
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        clearance = self.clearance()
+        i = np.floor(xs * self.resolution)
+        j = np.floor(ys * self.resolution)
+        inside = (i >= 0) & (i < clearance.shape[0]) & (j >= 0) & (j < clearance.shape[1])
+        result = np.zeros(xs.shape, dtype=np.float32)
+        result[inside] = clearance[i[inside].astype(np.intp), j[inside].astype(np.intp)]
+        return result
+    
+    def blocked_many(self, xs, ys, radius=0.0):
+        """ Whether a robot of the given radius can not stand at the points: outside of the map, in an obstacle
+        or (for radius > 0) closer than radius to an obstacle or the map border """
+        blocked = ~self.in_map_many(xs, ys) | self.in_obstacle_many(xs, ys)
+        if radius > 0:
+            blocked |= self.clearance_many(xs, ys) < radius
+        return blocked
+    
+    def free_grid(self, radius=0.0, window=None):
+        """ Boolean raster of the integer grid points, indexed [x, y]; True where a robot of the given radius fits.
+        
+        window = (x0, x1, y0, y1) restricts the raster to the grid points x0 <= x < x1, y0 <= y < y1
+        """
+        free = ~self.occupancy_grid(window)
+        if radius > 0:
+            x0, x1, y0, y1 = window if window is not None else (0, self.width, 0, self.height)
+            free &= self.clearance_many(np.arange(x0, x1)[:, None], np.arange(y0, y1)[None, :]) >= radius
+        return free
+    
+    def segments_near_obstacle(self, x1, y1, x2, y2, radius):
+        """ Vectorized test whether the segments (x1, y1) -> (x2, y2) come closer than radius to an obstacle or the map border.
+        
+        The clearance raster is read at points along the segments at most one raster cell apart. The
+        distance to the obstacles changes at most by half of that spacing between two points, which is
+        added to the radius.
+        """
+        x1, y1, x2, y2 = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (x1, y1, x2, y2)))
+        if x1.size == 0:
+            return np.zeros(x1.shape, dtype=bool)
+        spacing = 1 / self.resolution
+        n = int(np.ceil(np.hypot(x2 - x1, y2 - y1).max() / spacing)) + 1
+        t = np.linspace(0, 1, n)
+        xs = x1[..., None] + (x2 - x1)[..., None] * t
+        ys = y1[..., None] + (y2 - y1)[..., None] * t
+        return (self.clearance_many(xs, ys) < radius + spacing / 2).any(axis=-1)
+    
+    def segments_in_obstacle(self, x1, y1, x2, y2):
+        """ Vectorized exact test whether the segments (x1, y1) -> (x2, y2) touch any obstacle, returns a boolean array """
+        return segments_in_rectangles(x1, y1, x2, y2, self.obstacle_bounds())
+    
+    def segment_in_obstacle(self, p1, p2):
+        """ Exact test whether the segment p1 -> p2 touches any obstacle """
+        if len(self._obstacles) > 16:
+            return bool(self.segments_in_obstacle(p1[0], p1[1], p2[0], p2[1]))
+        # for a few obstacles the plain slab method is faster than setting up arrays
+        for o in self._obstacles:
+            t_enter, t_exit = 0.0, 1.0
+            for p, q, lo, hi in ((p1[0], p2[0], o.x, o.x + o.width), (p1[1], p2[1], o.y, o.y + o.height)):
+                d = q - p
+                if d == 0:
+                    if p < lo or p > hi:
+                        break
+                    continue
+                t_lo, t_hi = (lo - p) / d, (hi - p) / d
+                t_enter = max(t_enter, min(t_lo, t_hi))
+                t_exit = min(t_exit, max(t_lo, t_hi))
+            else:
+                if t_enter <= t_exit:
+                    return True
+        return False
+    
+    def shortcut_path(self, path, radius=0.0):
+        """Greedy line-of-sight smoothing: from each point jump to the furthest later point that is visible from it.
+        
+        With radius > 0 the shortcuts keep that distance from the obstacles (see segments_near_obstacle).
+        """
+        if path is None or len(path) < 3:
+            return path
+        points = np.asarray(path, dtype=float)
+        result = [path[0]]
+        i = 0
+        while i < len(path) - 1:
+            # segments from point i to all later points are tested in one call
+            later = points[i + 1:]
+            if radius > 0:
+                blocked = self.segments_near_obstacle(points[i, 0], points[i, 1], later[:, 0], later[:, 1], radius)
+            else:
+                blocked = self.segments_in_obstacle(points[i, 0], points[i, 1], later[:, 0], later[:, 1])
+            visible = np.flatnonzero(~blocked)
+            i = i + 1 + (int(visible[-1]) if len(visible) else 0)
+            result.append(path[i])
+        return result
+    
     def in_map(self, x, y):
         return x >= 0 and x <= self.width - 1 and y >= 0 and y <= self.height - 1
     
+    def in_map_many(self, xs, ys):
+        """ Vectorized in_map """
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        return (xs >= 0) & (xs <= self.width - 1) & (ys >= 0) & (ys <= self.height - 1)
+    
+    def occupancy_grid(self, window=None):
+        """ Boolean raster of the integer grid points, indexed [x, y]; True where the point lies in an obstacle
+        
+        window = (x0, x1, y0, y1) restricts the raster to the grid points x0 <= x < x1, y0 <= y < y1
+        """
+        x_lo, x_hi, y_lo, y_hi = window if window is not None else (0, self.width, 0, self.height)
+        grid = np.zeros((x_hi - x_lo, y_hi - y_lo), dtype=bool)
+        for o in self._obstacles:
+            # grid points covered by the (closed) rectangle, clipped to the window
+            x0 = max(math.ceil(o.x), x_lo)
+            x1 = min(math.floor(o.x + o.width), x_hi - 1)
+            y0 = max(math.ceil(o.y), y_lo)
+            y1 = min(math.floor(o.y + o.height), y_hi - 1)
+            if x0 <= x1 and y0 <= y1:
+                grid[x0 - x_lo:x1 + 1 - x_lo, y0 - y_lo:y1 + 1 - y_lo] = True
+        return grid
+    
     def plot_map(self):
         
         fig, ax = plt.subplots(figsize=(7, 4))
@@ -78,6 +389,13 @@ class Map:
             "seats": [{"id": s.id, "x": s.x, "y": s.y} for s in self.seats]
         }
         
+    @staticmethod
+    def from_dict(data, resolution=4):
+        """ Map from the format of to_dict (e.g. the definition stored in a compiled bundle) """
+        obstacles = [Obstacle(o["x"], o["y"], o["width"], o["height"]) for o in data["obstacles"]]
+        seats = [Seat(s["id"], s["x"], s["y"]) for s in data["seats"]]
+        return Map(data["width"], data["height"], obstacles, seats, resolution)
+        
     def plot_path(self, path):
         start = path[0]
         goal = path[-1]
@@ -191,12 +509,113 @@ class Node:
 
     def point(self):
         return (self.x, self.y)
+
+
+class RRTTree:
+    """Tree of RRT* stored in preallocated coordinate / cost / parent arrays.
+    
+    Nodes are additionally sorted into a spatial hash of square cells with side cell_size, each cell
+    holding the indices of its nodes in a growing array, so queries up to cell_size only look at the
+    3x3 cells around the query point.
+    """
+    def __init__(self, capacity, cell_size):
+        self.x = np.empty(capacity)
+        self.y = np.empty(capacity)
+        self.cost = np.empty(capacity)
+        self.parent = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+        self.cell_size = cell_size
+        # cell -> [index buffer, number of used entries]
+        self._cells = {}
+    
+    def __len__(self):
+        return self.size
+    
+    def _cell(self, p):
+        return (math.floor(p[0] / self.cell_size), math.floor(p[1] / self.cell_size))
+    
+    def add(self, p, parent, cost):
+        i = self.size
+        if i == len(self.x):
+            # full (e.g. RRT-Connect adding several nodes per iteration): double the capacity
+            self.x, self.y, self.cost, self.parent = (np.concatenate((a, np.empty_like(a)))
+                                                      for a in (self.x, self.y, self.cost, self.parent))
+        self.x[i], self.y[i] = p
+        self.parent[i] = parent
+        self.cost[i] = cost
+        self.size += 1
+        
+        cell = self._cells.setdefault(self._cell(p), [np.empty(16, dtype=np.int64), 0])
+        if cell[1] == len(cell[0]):
+            cell[0] = np.concatenate((cell[0], np.empty(len(cell[0]), dtype=np.int64)))
+        cell[0][cell[1]] = i
+        cell[1] += 1
+        return i
+    
+    def point(self, i):
+        return (float(self.x[i]), float(self.y[i]))
+    
+    def _candidates(self, p):
+        """ Indices of the nodes in the 3x3 cells around p """
+        cx, cy = self._cell(p)
+        candidates = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cell = self._cells.get((cx + dx, cy + dy))
+                if cell is not None:
+                    candidates.append(cell[0][:cell[1]])
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(candidates)
+    
+    def nearest(self, p):
+        """ Index of the node closest to p """
+        candidates = self._candidates(p)
+        if len(candidates):
+            # squared distances, the square root is not needed for the comparisons
+            dx, dy = self.x[candidates] - p[0], self.y[candidates] - p[1]
+            d = dx * dx + dy * dy
+            k = d.argmin()
+            # nodes outside of the 3x3 cells are further away than cell_size
+            if d[k] <= self.cell_size * self.cell_size:
+                return int(candidates[k])
+        d = np.hypot(self.x[:self.size] - p[0], self.y[:self.size] - p[1])
+        return int(np.argmin(d))
+    
+    def near(self, p, radius):
+        """ Indices of the nodes within radius (<= cell_size) of p and their distances to p """
+        candidates = self._candidates(p)
+        dx, dy = self.x[candidates] - p[0], self.y[candidates] - p[1]
+        d = dx * dx + dy * dy
+        mask = d <= radius * radius
+        return candidates[mask], np.sqrt(d[mask])
+    
+    def path_to(self, i):
+        """ Points from the root to node i """
+        path = []
+        while i >= 0:
+            path.append(self.point(i))
+            i = self.parent[i]
+        path.reverse()
+        return path
+    
+    def to_nodes(self):
+        """ The tree as list of linked Node objects """
+        nodes = [Node(x, y) for x, y in zip(self.x[:self.size].tolist(), self.y[:self.size].tolist())]
+        for n, parent, cost in zip(nodes, self.parent[:self.size].tolist(), self.cost[:self.size].tolist()):
+            n.cost = cost
+            if parent >= 0:
+                n.parent = nodes[parent]
+        return nodes
+
     
 class RRT:
     
-    def __init__(self, map, maxiter = 5000, step_len = 2.0, search_rad = 6.0, goal_rad = 3.0):
+    def __init__(self, map, maxiter = 5000, step_len = 2.0, search_rad = 6.0, goal_rad = 3.0, robot_radius = 0.0):
         # search_rad should be around 3x step_len, both grow with map size
         self.map = map
+        # edges keep this distance from obstacles and walls, checked on the clearance raster of the map
+        self.robot_radius = robot_radius
         
         self.maxiter = maxiter
         self.step_len = step_len
@@ -207,28 +626,35 @@ class RRT:
         return math.hypot(a[0] - b[0], a[1] - b[1])
 
 
-    def segment_collision(self, p1, p2, step=0.5):
-        """Returns True if the segment p1->p2 intersects any obstacle (rectangle)."""
-        length = self.distance(p1, p2)
-        steps = max(2, int(length / step))
-        for i in range(steps + 1):
-            t = i / steps
-            x = p1[0] + t * (p2[0] - p1[0])
-            y = p1[1] + t * (p2[1] - p1[1])
-            for o in self.map.obstacles:
-                if o.is_inside(x, y):
-                    return True
-        return False
+    def segment_collision(self, p1, p2):
+        """Returns True if the segment p1->p2 intersects any obstacle (rectangle) or comes closer than robot_radius."""
+        if self.robot_radius > 0:
+            return bool(self.map.segments_near_obstacle(p1[0], p1[1], p2[0], p2[1], self.robot_radius))
+        return self.map.segment_in_obstacle(p1, p2)
+    
+    def segments_collision(self, x1, y1, x2, y2):
+        """Vectorized segment_collision for the segments (x1[i], y1[i]) -> (x2[i], y2[i]), returns a boolean array."""
+        if self.robot_radius > 0:
+            return self.map.segments_near_obstacle(x1, y1, x2, y2, self.robot_radius)
+        return self.map.segments_in_obstacle(x1, y1, x2, y2)
+    
+    def _edges_collision(self, tree, nodes, p):
+        """ segments_collision of the edges from the tree nodes to the point p """
+        if self.robot_radius == 0 and len(self.map.obstacles) <= 16 and len(nodes) <= 64:
+            # few obstacles and edges (the usual batches of _iterate): the plain slab method of
+            # segment_in_obstacle is faster than setting up the arrays of segments_in_rectangles
+            return np.array([self.map.segment_in_obstacle(q, p) for q in zip(tree.x[nodes].tolist(), tree.y[nodes].tolist())],
+                            dtype=bool)
+        return self.segments_collision(tree.x[nodes], tree.y[nodes], p[0], p[1])
+    
+    def shortcut_path(self, path):
+        return self.map.shortcut_path(path, self.robot_radius)
 
 
     def random_point(self):
         return (random.uniform(0, self.map.width), random.uniform(0, self.map.height))
 
 
-    def nearest(self, nodes, p):
-        return min(nodes, key=lambda n: self.distance([n.x, n.y], p))
-
-
     def steer(self,from_p, to_p):
         d = self.distance(from_p, to_p)
         if d <= self.step_len:
@@ -237,68 +663,435 @@ class RRT:
         return (from_p[0] + self.step_len * math.cos(theta),
                 from_p[1] + self.step_len * math.sin(theta))
 
+    def _iterate(self, tree):
+        """ One RRT* iteration on tree: sample, connect to the best parent and rewire. Returns the new node or -1 """
+        rnd = self.random_point()
+        nearest = tree.nearest(rnd)
+        nearest_point = tree.point(nearest)
+        new_point = self.steer(nearest_point, rnd)
 
-    def near_nodes(self, nodes, new_node):
-        return [n for n in nodes if self.distance((n.x, n.y), (new_node.x, new_node.y)) <= self.search_rad]
+        if self.segment_collision(nearest_point, new_point):
+            return -1  # skip if edge collides
 
-    def rrt_star(self, start, goal):
-        nodes = [Node(*start)]
-        goal_node = None
+        # Choose best parent among nearby nodes (cost + new edge). Only the nodes cheaper than the
+        # nearest one are candidates, their edges are checked in batches in the order of the cost
+        # (one by one if the exact check of single edges is cheap, see _edges_collision)
+        near, d = tree.near(new_point, self.search_rad)
+        min_parent = nearest
+        min_cost = tree.cost[nearest] + self.distance(nearest_point, new_point)
 
-        for _ in range(self.maxiter):
-            rnd = self.random_point()
-            nearest_node = self.nearest(nodes, rnd)
-            new_point = self.steer(nearest_node.point(), rnd)
+        costs = tree.cost[near] + d
+        order = np.flatnonzero(costs < min_cost)
+        order = order[np.argsort(costs[order])]
+        step = 1 if self.robot_radius == 0 and len(self.map.obstacles) <= 16 else 16
+        for k in range(0, len(order), step):
+            batch = near[order[k:k + step]]
+            free = ~self._edges_collision(tree, batch, new_point)
+            if free.any():
+                min_parent = int(batch[np.argmax(free)])
+                min_cost = float(tree.cost[min_parent] + self.distance(tree.point(min_parent), new_point))
+                break
 
-            if self.segment_collision(nearest_node.point(), new_point):
-                continue  # skip if edge collides
+        new = tree.add(new_point, min_parent, min_cost)
 
-            new_node = Node(*new_point)
+        # Rewire nearby nodes through the new node if cheaper, edges are only checked for those
+        new_costs = min_cost + d
+        rewire = (near != min_parent) & (new_costs < tree.cost[near])
+        candidates = near[rewire]
+        if len(candidates):
+            free = ~self._edges_collision(tree, candidates, new_point)
+            tree.parent[candidates[free]] = new
+            tree.cost[candidates[free]] = new_costs[rewire][free]
+        return new
 
-            # Choose best parent among nearby nodes (cost + new edge)
-            near = self.near_nodes(nodes, new_node)
-            min_parent = nearest_node
-            min_cost = nearest_node.cost + self.distance(nearest_node.point(), new_node.point())
+    def rrt_star(self, start, goal):
+        tree = RRTTree(self.maxiter + 1, max(self.search_rad, self.step_len))
+        tree.add(start, -1, 0.0)
+        goal_index = -1
+        goal_cost = math.inf
 
-            for n in near:
-                if self.segment_collision(n.point(), new_node.point()):
-                    continue
-                c = n.cost + self.distance(n.point(), new_node.point())
-                if c < min_cost:
-                    min_cost = c
-                    min_parent = n
-
-            new_node.cost = min_cost
-            new_node.parent = min_parent
-            nodes.append(new_node)
-
-            # Rewire nearby nodes through the new node if cheaper
-            for n in near:
-                if n is min_parent:
-                    continue
-                if self.segment_collision(n.point(), new_node.point()):
-                    continue
-                new_cost = new_node.cost + self.distance(n.point(), new_node.point())
-                if new_cost < n.cost:
-                    n.parent = new_node
-                    n.cost = new_cost
+        for _ in range(self.maxiter):
+            new = self._iterate(tree)
 
             # Check for goal region
-            if self.distance(new_node.point(), goal) <= self.goal_rad:
-                if goal_node is None or new_node.cost < goal_node.cost:
-                    goal_node = new_node
+            if new >= 0 and self.distance(tree.point(new), goal) <= self.goal_rad and tree.cost[new] < goal_cost:
+                goal_index, goal_cost = new, tree.cost[new]
 
-        if goal_node is None:
+        nodes = tree.to_nodes()
+        if goal_index < 0:
             return None, nodes  # failed to find a path
 
-        # Construct path from goal_node back to start
-        path = []
-        n = goal_node
-        while n is not None:
-            path.append(n.point())
-            n = n.parent
-        path.reverse()
-        return path, nodes
+        # Construct path from goal node back to start
+        return tree.path_to(goal_index), nodes
+
+    def rrt_connect(self, start, goal):
+        """RRT-Connect: trees grown from start and goal in turns, each new node is greedily connected to the other tree.
+
+        Finds a first path much faster than rrt_star in narrow passages, the path is not optimal but
+        smoothed with shortcut_path. Returns the path (None if the trees did not meet within maxiter
+        iterations) and the nodes of both trees like rrt_star.
+        """
+        cell_size = max(self.search_rad, self.step_len)
+        trees = [RRTTree(self.maxiter + 1, cell_size), RRTTree(self.maxiter + 1, cell_size)]
+        trees[0].add(start, -1, 0.0)
+        trees[1].add(goal, -1, 0.0)
+        path = None
+
+        for k in range(self.maxiter):
+            a, b = trees[k % 2], trees[1 - k % 2]
+            new = self._extend(a, self.random_point())
+            if new < 0:
+                continue
+            reached = self._connect(b, a.point(new))
+            if reached >= 0:
+                # both trees contain the connecting point, the path runs from the root of a to the root of b
+                path = a.path_to(new) + b.path_to(reached)[::-1][1:]
+                if a is trees[1]:
+                    path.reverse()
+                path = self.shortcut_path(path)
+                break
+
+        return path, trees[0].to_nodes() + trees[1].to_nodes()
+
+    def _extend(self, tree, target):
+        """ Add a node one step from the nearest node towards target, returns it or -1 if the step collides """
+        nearest = tree.nearest(target)
+        nearest_point = tree.point(nearest)
+        new_point = self.steer(nearest_point, target)
+        if self.segment_collision(nearest_point, new_point):
+            return -1
+        return tree.add(new_point, nearest, tree.cost[nearest] + self.distance(nearest_point, new_point))
+
+    def _connect(self, tree, target):
+        """ Extend tree towards target until it is reached (returns the node at target) or blocked (returns -1) """
+        while True:
+            new = self._extend(tree, target)
+            if new < 0:
+                return -1
+            if tree.point(new) == target:
+                return new
+
+    def rrt_star_anytime(self, start, goal, budget=0.05, callback=None, time_limit=None):
+        """Anytime RRT*: returns the first path found within budget seconds (or None) and the running search.
+
+        The search keeps refining in a background thread, see AnytimeRRTStar for how improved paths are published.
+        """
+        search = AnytimeRRTStar(self, start, goal, callback, time_limit)
+        search.start()
+        return search.wait_first(budget), search
+
+
+class AnytimeRRTStar:
+    """RRT* search in a background thread that publishes every improvement of the path to the goal.
+
+    best_path / best_cost always hold the best path so far, callback(path, cost) is called from the
+    search thread for each improved path, the future first is resolved with the first path found and
+    final with the last one (None if there is none). The search ends after maxiter iterations of the
+    RRT, after time_limit seconds or when stop() is called.
+    """
+    def __init__(self, rrt, start, goal, callback=None, time_limit=None):
+        self.rrt = rrt
+        self.start_point = start
+        self.goal = goal
+        self.callback = callback
+        self.time_limit = time_limit
+        self.best_path = None
+        self.best_cost = math.inf
+        self.iterations = 0
+        self.first = Future()
+        self.final = Future()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """ Stop refining, final is resolved with the best path so far """
+        self._stop.set()
+
+    def wait_first(self, timeout=None):
+        """ First path found, None if there is none after timeout seconds """
+        try:
+            return self.first.result(timeout)
+        except TimeoutError:
+            return None
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            rrt = self.rrt
+            tree = RRTTree(rrt.maxiter + 1, max(rrt.search_rad, rrt.step_len))
+            tree.add(self.start_point, -1, 0.0)
+            goal_index = -1
+            t_end = time.perf_counter() + self.time_limit if self.time_limit is not None else math.inf
+            for _ in range(rrt.maxiter):
+                if self._stop.is_set() or time.perf_counter() > t_end:
+                    break
+                self.iterations += 1
+                new = rrt._iterate(tree)
+                if new >= 0 and rrt.distance(tree.point(new), self.goal) <= rrt.goal_rad and (goal_index < 0 or tree.cost[new] < tree.cost[goal_index]):
+                    goal_index = new
+                # rewiring may also have shortened the path to the current goal node
+                if goal_index >= 0 and tree.cost[goal_index] < self.best_cost - 1e-9:
+                    self._publish(tree.path_to(goal_index), float(tree.cost[goal_index]))
+            if not self.first.done():
+                self.first.set_result(None)
+            self.final.set_result(self.best_path)
+        except Exception as e:
+            for future in (self.first, self.final):
+                if not future.done():
+                    future.set_exception(e)
+
+    def _publish(self, path, cost):
+        self.best_path, self.best_cost = path, cost
+        if not self.first.done():
+            self.first.set_result(path)
+        if self.callback is not None:
+            self.callback(path, cost)
+
+
+class ParallelRRT:
+    """Best-of-N RRT*: independent seeded RRT* searches run in worker processes, the cheapest path wins.
+
+    The obstacle rectangles are written once per map version into a shared memory block, the workers
+    rebuild the map from it when they start and tasks only carry the seed, start and goal. The pool
+    is kept between queries and recreated when the map changes, close() releases it.
+    """
+    def __init__(self, map, workers=4, maxiter=5000, step_len=2.0, search_rad=6.0, goal_rad=3.0, robot_radius=0.0):
+        self.map = map
+        self.workers = workers
+        self.params = dict(maxiter=maxiter, step_len=step_len, search_rad=search_rad,
+                           goal_rad=goal_rad, robot_radius=robot_radius)
+        self._pool = None
+        self._shm = None
+        self._map_version = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _ensure_pool(self):
+        if self._pool is not None and self._map_version == self.map.version:
+            return
+        self.close()
+        bounds = self.map.obstacle_bounds()
+        self._shm = shared_memory.SharedMemory(create=True, size=max(bounds.nbytes, 1))
+        np.ndarray(bounds.shape, dtype=bounds.dtype, buffer=self._shm.buf)[:] = bounds
+        geometry = (self._shm.name, len(bounds), self.map.width, self.map.height, self.map.resolution)
+        self._pool = ProcessPoolExecutor(self.workers, initializer=_init_rrt_worker,
+                                         initargs=(geometry, self.params))
+        self._map_version = self.map.version
+
+    def rrt_star(self, start, goal, runs=None, seed=0):
+        """ Run runs (default one per worker) RRT* searches with the seeds seed, seed + 1, ...
+
+        Returns the cheapest path (None if no search found one) and its length.
+        """
+        self._ensure_pool()
+        runs = self.workers if runs is None else runs
+        results = self._pool.map(_run_rrt_worker, [(seed + i, start, goal) for i in range(runs)])
+        return min(results, key=lambda result: result[1])
+
+
+# RRT of the worker process, built by _init_rrt_worker
+_worker_rrt = None
+
+
+def _init_rrt_worker(geometry, params):
+    global _worker_rrt
+    name, count, width, height, resolution = geometry
+    shm = shared_memory.SharedMemory(name=name)
+    bounds = np.ndarray((count, 4), dtype=float, buffer=shm.buf).copy()
+    shm.close()
+    obstacles = [Obstacle(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in bounds.tolist()]
+    _worker_rrt = RRT(Map(width, height, obstacles, [], resolution), **params)
+
+
+def _run_rrt_worker(task):
+    seed, start, goal = task
+    random.seed(seed)
+    path, _ = _worker_rrt.rrt_star(start, goal)
+    if path is None:
+        return None, math.inf
+    return path, sum(_worker_rrt.distance(path[i], path[i + 1]) for i in range(len(path) - 1))
+
+
+class ProbabilisticRoadmap:
+    """Roadmap of random free points for multi-query planning, built once per map and kept on disk.
+
+    Samples closer than connect_rad are connected by edges which are collision checked lazily: a query
+    searches the shortest path over all edges not known to be blocked, checks the unchecked edges at
+    the nodes of that path and searches again if one of the path is blocked. Check results are kept,
+    so queries get cheaper with use. With path given the roadmap is loaded from that .npz file if it
+    was saved for the same map and parameters, otherwise it is built and saved there; queries that
+    checked new edges write the results back to the file (see flush).
+    """
+    UNKNOWN, FREE, BLOCKED = 0, 1, 2
+
+    def __init__(self, map, samples=1000, connect_rad=6.0, robot_radius=0.0, seed=0, path=None):
+        self.map = map
+        self.samples = samples
+        self.connect_rad = connect_rad
+        self.robot_radius = robot_radius
+        self.seed = seed
+        self.path = path
+        # edge checks not written to path yet
+        self._unsaved = False
+        if path is None or not self.load(path):
+            self.build()
+            if path is not None:
+                self.save(path)
+
+    def build(self):
+        """ Sample the free points and connect them, no edge is checked yet """
+        rng = np.random.default_rng(self.seed)
+        points, count = [], 0
+        while count < self.samples:
+            p = rng.uniform((0, 0), (self.map.width - 1, self.map.height - 1), size=(self.samples, 2))
+            p = p[~self.map.blocked_many(p[:, 0], p[:, 1], self.robot_radius)]
+            if len(p) == 0 and count == 0:
+                raise ValueError("No free space in the map")
+            points.append(p)
+            count += len(p)
+        self.points = np.concatenate(points)[:self.samples]
+        self.edges = cKDTree(self.points).query_pairs(self.connect_rad, output_type="ndarray").astype(np.int64)
+        self.state = np.full(len(self.edges), self.UNKNOWN, dtype=np.int8)
+        self._index()
+
+    def _index(self):
+        # edges (u < v) sorted by u and v are the rows of an upper triangular CSR graph, edge i is entry i
+        order = np.lexsort((self.edges[:, 1], self.edges[:, 0]))
+        self.edges, self.state = self.edges[order], self.state[order]
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(self.edges[:, 0], minlength=len(self.points)))))
+        p, q = self.points[self.edges[:, 0]], self.points[self.edges[:, 1]]
+        self.lengths = np.hypot(*(q - p).T)
+        self.kdtree = cKDTree(self.points)
+        self._map_version = self.map.version
+
+    def _params(self):
+        return np.array([self.map.width, self.map.height, self.samples, self.connect_rad, self.robot_radius, self.seed], dtype=float)
+
+    def save(self, path):
+        np.savez(path, params=self._params(), obstacles=self.map.obstacle_bounds(),
+                 points=self.points, edges=self.edges, state=self.state)
+        if path == self.path:
+            self._unsaved = False
+
+    def flush(self):
+        """ Write edge checks made since the last save to path (if the roadmap has one) """
+        if self.path is not None and self._unsaved:
+            self.save(self.path)
+
+    def load(self, path):
+        """ Read a roadmap saved for the same map and parameters, returns False if there is none """
+        try:
+            with np.load(path) as data:
+                if not (np.array_equal(data["params"], self._params())
+                        and np.array_equal(data["obstacles"], self.map.obstacle_bounds())):
+                    return False
+                self.points, self.edges, self.state = data["points"], data["edges"], data["state"]
+        except (OSError, KeyError, ValueError):
+            return False
+        self._index()
+        return True
+
+    def _check_version(self):
+        """ After a map change the edge checks are redone, edges of samples now inside obstacles are blocked """
+        if self._map_version == self.map.version:
+            return
+        blocked = self.map.blocked_many(self.points[:, 0], self.points[:, 1], self.robot_radius)
+        self.state[:] = np.where(blocked[self.edges].any(axis=1), self.BLOCKED, self.UNKNOWN)
+        self._map_version = self.map.version
+        self._unsaved = True
+
+    def _collision(self, p, q):
+        if self.robot_radius > 0:
+            return self.map.segments_near_obstacle(p[:, 0], p[:, 1], q[:, 0], q[:, 1], self.robot_radius)
+        return self.map.segments_in_obstacle(p[:, 0], p[:, 1], q[:, 0], q[:, 1])
+
+    def _attach(self, point):
+        """ Roadmap nodes start or goal is connected to: all within connect_rad, else the 10 nearest """
+        nearby = self.kdtree.query_ball_point(point, self.connect_rad)
+        if not nearby:
+            nearby = self.kdtree.query(point, k=min(10, len(self.points)))[1]
+        return np.atleast_1d(np.asarray(nearby, dtype=np.int64))
+
+    def path_from_to(self, start, goal):
+        """ Shortest roadmap path from start to goal as a list of points, raises ValueError if there is none """
+        try:
+            return self._search(start, goal)
+        finally:
+            self.flush()
+
+    def _search(self, start, goal):
+        self._check_version()
+        ends = np.array([start, goal], dtype=float)
+        if self.map.blocked_many(ends[:, 0], ends[:, 1], self.robot_radius).any():
+            raise ValueError("Start or goal is not free")
+        if not self._collision(ends[:1], ends[1:])[0]:
+            return [tuple(start), tuple(goal)]
+
+        # start and goal become the nodes n and n + 1 with the rows n and n + 1 of the graph, their
+        # edges are checked lazily as well
+        n, m = len(self.points), len(self.edges)
+        points = np.vstack((self.points, ends))
+        attached = [np.sort(self._attach(p)) for p in (start, goal)]
+        indptr = np.concatenate((self.indptr, [m + len(attached[0]), m + len(attached[0]) + len(attached[1])]))
+        indices = np.concatenate((self.edges[:, 1], *attached))
+        u = np.repeat(np.arange(n + 2), np.diff(indptr))
+        lengths = np.concatenate((self.lengths, np.hypot(*(points[indices[m:]] - points[u[m:]]).T)))
+        state = np.concatenate((self.state, np.full(len(indices) - m, self.UNKNOWN, dtype=np.int8)))
+
+        while True:
+            # blocked edges get infinite length, the tiny offset keeps edges of length 0 in the graph
+            weights = np.where(state == self.BLOCKED, np.inf, lengths + 1e-12)
+            graph = sp.csr_matrix((weights, indices, indptr), shape=(n + 2, n + 2))
+            dist, pred = csg.dijkstra(graph, directed=False, indices=n, return_predecessors=True)
+            if np.isinf(dist[n + 1]):
+                raise ValueError("No path found")
+            nodes = [n + 1]
+            while nodes[-1] != n:
+                nodes.append(int(pred[nodes[-1]]))
+            nodes.reverse()
+
+            # edges of the path not checked yet: these and all other unchecked edges at the nodes of the
+            # path (likely candidates of the next search) are checked in one batch
+            on_path = np.zeros(n + 2, dtype=bool)
+            on_path[nodes] = True
+            unknown = np.flatnonzero((on_path[u] | on_path[indices]) & (state == self.UNKNOWN))
+            if len(unknown):
+                blocked = self._collision(points[u[unknown]], points[indices[unknown]])
+                state[unknown] = np.where(blocked, self.BLOCKED, self.FREE)
+                roadmap = unknown < m
+                self.state[unknown[roadmap]] = state[unknown[roadmap]]
+                self._unsaved |= bool(roadmap.any())
+                if (state[self._path_entries(indptr, indices, nodes)] == self.BLOCKED).any():
+                    continue
+            return self.map.shortcut_path([tuple(p) for p in points[nodes].tolist()], self.robot_radius)
+
+    @staticmethod
+    def _path_entries(indptr, indices, nodes):
+        """ Graph entries of the edges between consecutive nodes, stored in the row of the smaller node """
+        entries = []
+        for a, b in zip(nodes, nodes[1:]):
+            # the rows of start and goal (the last two) hold their edges to the roadmap
+            row, column = (min(a, b), max(a, b)) if max(a, b) < len(indptr) - 3 else (max(a, b), min(a, b))
+            entries.append(indptr[row] + int(np.searchsorted(indices[indptr[row]:indptr[row + 1]], column)))
+        return np.array(entries)
 
 
 ### End Pathfinding with RRT* ###
@@ -307,55 +1100,394 @@ class RRT:
     
 class GraphMap:
     """Graph representation of the map for finding a path using dijkstra (or another graph shortest-path algorithm)"""
-    def __init__(self, map: Map):
-        # internal enumeration of nodes since adjacency matrix is |V|x|V|, can't be indexed by tuples
-        nodes_to_coord = {}
-        coord_to_nodes = {}
-        i = 0
-        for x in range(0, map.width):
-            for y in range(0, map.height):
-                    nodes_to_coord.update({i : (x, y)})
-                    coord_to_nodes.update({(x, y) : i})
-                    i = i + 1
-        
-        # Initialize adjacency matrix
-        adjacency_matrix = np.zeros((map.width * map.height, map.width * map.height))
-        
-        for x in range(0, map.width):
-            for y in range(0, map.height):
-                orth_neighbors = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-                for (dx, dy) in orth_neighbors:
-                    if not(map.in_obstacle(x, y)) and map.in_map(x + dx, y + dy) and not(map.in_obstacle(x + dx, y + dy)):
-                        v = coord_to_nodes[(x, y)]
-                        w = coord_to_nodes[(x + dx, y + dy)]
-                        adjacency_matrix[v, w] = 1
-                
-                diag_neighbors = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
-                for (dx, dy) in diag_neighbors:
-                    if not(map.in_obstacle(x, y)) and map.in_map(x + dx, y + dy) and not(map.in_obstacle(x + dx, y + dy)):
-                        v = coord_to_nodes[(x, y)]
-                        w = coord_to_nodes[(x + dx, y + dy)]
-                        adjacency_matrix[v, w] = math.sqrt(2)
-        
-        self.nodes_to_coord = nodes_to_coord
-        self.coord_to_nodes = coord_to_nodes
-        self.graph = csg.csgraph_from_dense(adjacency_matrix)
+    
+    # (dx, dy) offsets of the 8-connected neighborhood and their edge weights, sorted such that
+    # the neighbor index x * height + y increases along the list
+    NEIGHBORS = [((-1, -1), math.sqrt(2)), ((-1, 0), 1.0), ((-1, 1), math.sqrt(2)), ((0, -1), 1.0),
+                 ((0, 1), 1.0), ((1, -1), math.sqrt(2)), ((1, 0), 1.0), ((1, 1), math.sqrt(2))]
+    # the 8 driving directions counterclockwise from the x axis in 45 degree steps and the
+    # index of a direction (dx, dy) at HEADING_INDEX[dx + 1, dy + 1]
+    HEADINGS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+    HEADING_INDEX = np.array([[5, 4, 3], [6, 0, 2], [7, 0, 1]])
+    
+    def __init__(self, map: Map, robot_radius=0.0, clearance_cost=0.0, clearance_range=1.0, graph=None, components=None):
+        # internal enumeration of nodes: node (x, y) has index x * height + y
         self.map = map
+        self.width = map.width
+        self.height = map.height
+        # grid points closer than robot_radius to an obstacle or wall are blocked, edges near obstacles
+        # cost up to (1 + clearance_cost) times their length, falling linearly to 1 at clearance_range
+        self.robot_radius = robot_radius
+        self.clearance_cost = clearance_cost
+        self.clearance_range = clearance_range
+        self.map_version = map.version
+        self.free = map.free_grid(robot_radius)
+        self.penalty = self._penalty()
+        # graph and its component labels may be given prebuilt for this map and parameters (see load_compiled_map)
+        self.graph = self._build_graph(self.free, self.penalty) if graph is None else graph
+        # graph_version counts all changes of the graph, changes log the nodes whose edges were
+        # updated incrementally so incremental planners can catch up (see DStarLite)
+        self.graph_version = 0
+        self.changes = deque(maxlen=64)
+        self.tree_cache = ShortestPathTreeCache(self)
+        self._nodes_to_coord = None
+        self._coord_to_nodes = None
+        # A* search state, allocated on the first A* query and reused by all following ones
+        self._g = None
+        self._pred = None
+        self._seen = None
+        self._query = 0
+        # (graph_version, graph) of the (node, heading) state graph for method "time"
+        self._heading_graph = None
+        # Jump Point Search on the raster of the map for method "jps", created on first use
+        self._jps = None
+        # cluster abstraction for method "hpa", created on first use
+        self._hpa = None
+        # landmark distances for method "alt", created on first use if not set (e.g. to load them from a file)
+        self.landmarks = None
+        # (graph_version, component labels, component sizes), see components
+        self._components = None if components is None else (self.graph_version, components, np.bincount(components))
+    
+    def refresh(self):
+        """ Rebuild the graph if the obstacles of the map changed since it was built """
+        if self.map_version != self.map.version:
+            self.free = self.map.free_grid(self.robot_radius)
+            self.penalty = self._penalty()
+            self.graph = self._build_graph(self.free, self.penalty)
+            self.map_version = self.map.version
+            self.graph_version += 1
+            self.changes.clear()
+    
+    ### Dynamic obstacles ###
+    
+    def add_obstacle(self, obstacle):
+        """ Add an obstacle to the map and update the edges around it, returns the indices of the updated nodes """
+        self.refresh()
+        self.map.add_obstacle(obstacle)
+        return self._update_region(obstacle)
+    
+    def remove_obstacle(self, obstacle):
+        """ Remove an obstacle from the map and update the edges around it, returns the indices of the updated nodes """
+        self.refresh()
+        self.map.remove_obstacle(obstacle)
+        return self._update_region(obstacle)
+    
+    def move_obstacle(self, obstacle, x, y):
+        """ Move an obstacle of the map to (x, y) and update the edges at both places, returns the indices of the updated nodes """
+        self.refresh()
+        old_region = Obstacle(obstacle.x, obstacle.y, obstacle.width, obstacle.height)
+        obstacle.x, obstacle.y = x, y
+        self.map.invalidate()
+        return np.union1d(self._update_region(old_region), self._update_region(obstacle))
+    
+    def _update_region(self, obstacle):
+        """ Recompute the free raster (and penalties) around obstacle and the edges of all nodes next to it """
+        # grid points whose free state or penalty may have changed, with clearance this includes the points
+        # within the robot radius / clearance range plus the error of the clearance raster
+        margin = 0.0
+        if self.robot_radius > 0 or self.clearance_cost > 0:
+            reach = max(self.robot_radius, self.clearance_range if self.clearance_cost > 0 else 0)
+            margin = reach + 2 * math.sqrt(2) / self.map.resolution
+        x0 = max(math.ceil(obstacle.x - margin), 0)
+        x1 = min(math.floor(obstacle.x + obstacle.width + margin), self.width - 1) + 1
+        y0 = max(math.ceil(obstacle.y - margin), 0)
+        y1 = min(math.floor(obstacle.y + obstacle.height + margin), self.height - 1) + 1
+        self.map_version = self.map.version
+        if x0 >= x1 or y0 >= y1:
+            return np.zeros(0, dtype=np.int64)
+        self.free[x0:x1, y0:y1] = self.map.free_grid(self.robot_radius, (x0, x1, y0, y1))
+        if self.penalty is not None:
+            self.penalty[x0:x1, y0:y1] = self._penalty((x0, x1, y0, y1))
         
-    def path_from_to(self, start, goal):
+        # edges change only for nodes on or next to these grid points
+        window = (max(x0 - 1, 0), min(x1 + 1, self.width), max(y0 - 1, 0), min(y1 + 1, self.height))
+        nodes, counts, indices, data = self._window_edges(self.free, *window, penalty=self.penalty)
+        self.graph = self._replace_rows(self.graph, nodes, counts, indices, data)
+        self.graph_version += 1
+        self.changes.append((self.graph_version, nodes))
+        return nodes
+    
+    @staticmethod
+    def _replace_rows(graph, rows, counts, indices, data):
+        """ CSR matrix graph with the (sorted) rows replaced by new rows given by their entry counts, indices and data """
+        new_counts = np.diff(graph.indptr)
+        new_counts[rows] = counts
+        indptr = np.zeros_like(graph.indptr)
+        np.cumsum(new_counts, out=indptr[1:])
+        
+        # rows come in runs of consecutive indices (one per column of the window), the entries
+        # between the runs are copied over unchanged
+        entry_ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=entry_ptr[1:])
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        run_first = np.concatenate(([0], breaks))
+        run_last = np.concatenate((breaks, [len(rows)]))
+        index_pieces, data_pieces = [], []
+        prev = 0
+        for i0, i1 in zip(run_first.tolist(), run_last.tolist()):
+            a, b = graph.indptr[prev], graph.indptr[rows[i0]]
+            index_pieces += [graph.indices[a:b], indices[entry_ptr[i0]:entry_ptr[i1]]]
+            data_pieces += [graph.data[a:b], data[entry_ptr[i0]:entry_ptr[i1]]]
+            prev = rows[i1 - 1] + 1
+        index_pieces.append(graph.indices[graph.indptr[prev]:])
+        data_pieces.append(graph.data[graph.indptr[prev]:])
+        return sp.csr_matrix((np.concatenate(data_pieces), np.concatenate(index_pieces).astype(graph.indices.dtype), indptr),
+                             shape=graph.shape)
+    
+    ### End of dynamic obstacles ###
+    
+    def _penalty(self, window=None):
+        """ Soft cost factor of the grid points (clearance_cost at the walls, 0 from clearance_range on), None without soft cost """
+        if self.clearance_cost <= 0:
+            return None
+        x0, x1, y0, y1 = window if window is not None else (0, self.width, 0, self.height)
+        clearance = self.map.clearance_many(np.arange(x0, x1)[:, None], np.arange(y0, y1)[None, :])
+        return self.clearance_cost * np.clip(1 - clearance / self.clearance_range, 0, None)
+    
+    @staticmethod
+    def _window_edges(free, x0, x1, y0, y1, penalty=None):
+        """ Edges of the nodes x0 <= x < x1, y0 <= y < y1 of the 8-connected grid on the free-space raster.
+        
+        For every neighbor offset the window is compared with a shifted copy of the raster, which gives
+        all valid edges in that direction at once. Returns the node indices of the window (ascending),
+        the number of edges per node and the CSR indices and weights of the edges. With a penalty raster
+        the weight is scaled by 1 + the mean penalty of both end points.
+        """
+        width, height = free.shape
+        # raster around the window with a border of one cell, outside of the map counts as blocked
+        padded = np.zeros((x1 - x0 + 2, y1 - y0 + 2), dtype=bool)
+        px0, px1, py0, py1 = max(x0 - 1, 0), min(x1 + 1, width), max(y0 - 1, 0), min(y1 + 1, height)
+        padded[px0 - x0 + 1:px1 - x0 + 1, py0 - y0 + 1:py1 - y0 + 1] = free[px0:px1, py0:py1]
+        
+        w, h = x1 - x0, y1 - y0
+        edges = np.empty((w, h, len(GraphMap.NEIGHBORS)), dtype=bool)
+        offsets = np.empty(len(GraphMap.NEIGHBORS), dtype=np.int64)
+        weights = np.empty(len(GraphMap.NEIGHBORS))
+        for k, ((dx, dy), weight) in enumerate(GraphMap.NEIGHBORS):
+            edges[:, :, k] = padded[1:-1, 1:-1] & padded[1 + dx:w + 1 + dx, 1 + dy:h + 1 + dy]
+            offsets[k] = dx * height + dy
+            weights[k] = weight
+        
+        nodes = (np.arange(x0, x1)[:, None] * height + np.arange(y0, y1)[None, :]).ravel()
+        edges = edges.reshape(w * h, -1)
+        row, k = np.nonzero(edges)
+        indices = nodes[row] + offsets[k]
+        weights = weights[k]
+        if penalty is not None:
+            flat = penalty.ravel()
+            weights = weights * (1 + (flat[nodes[row]] + flat[indices]) / 2)
+        return nodes, np.count_nonzero(edges, axis=1), indices, weights
+    
+    @staticmethod
+    def _build_graph(free, penalty=None):
+        """ Build the CSR adjacency matrix of the 8-connected grid from a free-space raster.
+        
+        The edge masks are stacked per node in neighbor order, so the CSR arrays can be filled
+        directly and memory stays O(cells).
+        """
+        width, height = free.shape
+        _, counts, indices, data = GraphMap._window_edges(free, 0, width, 0, height, penalty)
+        indptr = np.zeros(width * height + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return sp.csr_matrix((data, indices, indptr), shape=(width * height, width * height))
+    
+    @property
+    def nodes_to_coord(self):
+        if self._nodes_to_coord is None:
+            xs, ys = np.divmod(np.arange(self.width * self.height), self.height)
+            self._nodes_to_coord = dict(enumerate(zip(xs.tolist(), ys.tolist())))
+        return self._nodes_to_coord
+    
+    @property
+    def coord_to_nodes(self):
+        if self._coord_to_nodes is None:
+            self._coord_to_nodes = {coord: i for i, coord in self.nodes_to_coord.items()}
+        return self._coord_to_nodes
+    
+    def node_index(self, coord):
+        """ Index of the graph node at the integer grid point coord, raises KeyError outside of the map """
+        x, y = coord
+        if x != int(x) or y != int(y) or not self.map.in_map(x, y):
+            raise KeyError(coord)
+        return int(x) * self.height + int(y)
+    
+    def node_coord(self, index):
+        return (int(index) // self.height, int(index) % self.height)
+        
+    def path_from_to(self, start, goal, method="dijkstra", heading=None):
+        """ Shortest path from start to goal as list of grid points.
+        
+        method "dijkstra" runs a single-source search over the whole graph, "astar" runs an A* search
+        with octile-distance heuristic that stops as soon as the goal is reached and "tree" follows
+        the cached shortest-path tree rooted at the goal (see ShortestPathTreeCache). "jps" runs a Jump
+        Point Search on the raster of the map (see JumpPointSearch) and "hpa" a hierarchical search over
+        clusters of the grid (see HierarchicalMap), "alt" runs the A* search with the landmark
+        heuristic (see Landmarks). "time" returns the path that is fastest to drive
+        with turns included, starting with the given heading (degrees counterclockwise from the x axis,
+        None if the first turn is free).
+        """
+        self.refresh()
+        if method == "tree":
+            return self.tree_cache.path_from_to(start, goal)
+        if method == "jps":
+            if self._jps is None:
+                self._jps = JumpPointSearch(self.map, self.robot_radius)
+            return self._jps.path_from_to(start, goal)
+        if method == "hpa":
+            if self._hpa is None:
+                self._hpa = HierarchicalMap(self)
+            return self._hpa.path_from_to(start, goal)
         
         # round start since nodes of the graph are all integer
         start = (round(start[0]), round(start[1]))
         
-        start_index = self.coord_to_nodes[start]
-        goal_index = self.coord_to_nodes[goal]
+        start_index = self.node_index(start)
+        goal_index = self.node_index(goal)
+        labels, _ = self.components()
+        if labels[start_index] != labels[goal_index]:
+            raise ValueError(f"No connection from {start} to {goal}")
         
-        dist, pred = csg.shortest_path(self.graph, directed = False, indices = start_index, return_predecessors = True)
+        if method == "time":
+            return self._fastest_path(start_index, goal_index, heading)
+        elif method in ("astar", "alt"):
+            heuristic = None
+            if method == "alt":
+                if self.landmarks is None:
+                    self.landmarks = Landmarks(self)
+                heuristic = self._alt_heuristic(start_index, goal_index)
+            pred = self._astar(start_index, goal_index, heuristic)
+            # no path found - should never happen if map is well defined
+            if pred is None:
+                raise ValueError(f"No connection from {start} to {goal}")
+        elif method == "dijkstra":
+            dist, pred = csg.shortest_path(self.graph, directed = False, indices = start_index, return_predecessors = True)
+            
+            # no path found - should never happen if map is well defined
+            if np.isinf(dist[goal_index]):
+                raise ValueError(f"No connection from {start} to {goal}")
+        else:
+            raise ValueError(f"Unknown path finding method {method}")
         
-        # no path found - should never happen if map is well defined
-        if np.isinf(dist[goal_index]):
-            raise ValueError(f"No connection from {start} to {goal}")
+        return self._path_from_predecessors(pred, start_index, goal_index)
+    
+    def components(self):
+        """ Connected component label of every node (int32 array indexed by node) and the number of nodes
+        of each component. Computed once per graph version, blocked nodes are components of their own. """
+        self.refresh()
+        if self._components is None or self._components[0] != self.graph_version:
+            _, labels = csg.connected_components(self.graph, directed=False)
+            self._components = (self.graph_version, labels.astype(np.int32), np.bincount(labels))
+        return self._components[1:]
+    
+    def connected(self, a, b):
+        """ Whether there is a path between the points a and b (rounded to the grid) """
+        labels, _ = self.components()
+        a = self.node_index((round(a[0]), round(a[1])))
+        b = self.node_index((round(b[0]), round(b[1])))
+        return bool(labels[a] == labels[b])
+    
+    def unreachable_seats(self, origin=None):
+        """ Seats of the map that can not be reached from origin or, without origin, from the largest
+        connected free area (the floor of the restaurant) """
+        labels, sizes = self.components()
+        if origin is None:
+            label = np.argmax(sizes)
+        else:
+            label = labels[self.node_index((round(origin[0]), round(origin[1])))]
+        return [seat for seat in self.map.seats if labels[self.node_index((seat.x, seat.y))] != label]
+    
+    def nearest_of(self, start, candidates, k=1):
+        """ The k candidates (grid points) closest to start by path length, as list of (candidate, distance, path)
+        sorted by distance. Candidates that can not be reached are left out, so the list may be shorter.
+        
+        Runs a single Dijkstra search from start that stops as soon as k candidates are reached. Since
+        the graph is undirected it also answers which of several robots is closest to one seat.
+        """
+        self.refresh()
+        start = (round(start[0]), round(start[1]))
+        start_index = self.node_index(start)
+        # candidates in other components are never reached, the search stops once the others are
+        labels, _ = self.components()
+        targets = {}
+        for candidate in candidates:
+            index = self.node_index(candidate)
+            if labels[index] == labels[start_index]:
+                targets.setdefault(index, []).append(candidate)
+        
+        g, pred, seen, query = self._search_state()
+        indptr, indices, data = self.graph.indptr, self.graph.indices, self.graph.data
+        
+        g[start_index] = 0.0
+        pred[start_index] = -9999
+        seen[start_index] = query
+        reached = []
+        open_list = [(0.0, start_index)]
+        while open_list and targets and len(reached) < k:
+            g_v, v = heapq.heappop(open_list)
+            if g_v > g[v]:
+                continue  # outdated entry
+            if v in targets:
+                path = self._path_from_predecessors(pred, start_index, v)
+                reached += [(candidate, g_v, path) for candidate in targets.pop(v)]
+            a, b = indptr[v], indptr[v + 1]
+            for w, cost in zip(indices[a:b].tolist(), data[a:b].tolist()):
+                g_w = g_v + cost
+                if seen[w] != query or g_w < g[w]:
+                    seen[w] = query
+                    g[w] = g_w
+                    pred[w] = v
+                    heapq.heappush(open_list, (g_w, w))
+        return reached[:k]
+    
+    def heading_graph(self):
+        """ Directed graph over the states (node, heading) with the driving time in seconds as weights.
+        
+        State index is node * 8 + k for the heading HEADINGS[k]. A state has an edge to the neighbor
+        in its heading direction (time to drive there) and to the 45 degree turns on the spot (time
+        to rotate), so a search finds the route with the least time driving plus turning.
+        """
+        if self._heading_graph is not None and self._heading_graph[0] == self.graph_version:
+            return self._heading_graph[1]
+        n = self.graph.shape[0]
+        coo = self.graph.tocoo()
+        v, w = coo.row.astype(np.int64), coo.col.astype(np.int64)
+        heading = self.HEADING_INDEX[w // self.height - v // self.height + 1, w % self.height - v % self.height + 1]
+        move = coo.data * CELL_SIZE_CM * SECONDS_PER_CM["forward"]
+        
+        states = (np.flatnonzero(self.free.ravel())[:, None] * 8 + np.arange(8)[None, :]).ravel()
+        left = states - states % 8 + (states + 1) % 8
+        right = states - states % 8 + (states - 1) % 8
+        turn = np.full(2 * len(states), 45 * SECONDS_PER_DEGREE)
         
+        rows = np.concatenate((v * 8 + heading, states, states))
+        cols = np.concatenate((w * 8 + heading, left, right))
+        graph = sp.csr_matrix((np.concatenate((move, turn)), (rows, cols)), shape=(8 * n, 8 * n))
+        self._heading_graph = (self.graph_version, graph)
+        return graph
+    
+    def _fastest_path(self, start_index, goal_index, heading=None):
+        """ Path with the least driving time from start to goal by a search over the heading graph """
+        if heading is None:
+            sources = start_index * 8 + np.arange(8)
+        else:
+            sources = [start_index * 8 + round(heading / 45) % 8]
+        dist, pred, _ = csg.dijkstra(self.heading_graph(), directed=True, indices=sources,
+                                  return_predecessors=True, min_only=True)
+        
+        goal_states = goal_index * 8 + np.arange(8)
+        state = int(goal_states[np.argmin(dist[goal_states])])
+        if np.isinf(dist[state]):
+            raise ValueError(f"No connection from {self.node_coord(start_index)} to {self.node_coord(goal_index)}")
+        path = []
+        while state >= 0:
+            # turning on the spot gives consecutive states of the same node
+            if not path or path[-1] != state // 8:
+                path.append(state // 8)
+            state = pred[state]
+        path.reverse()
+        return [self.node_coord(node) for node in path]
+    
+    def _path_from_predecessors(self, pred, start_index, goal_index):
         path = []
         v = goal_index
         while v != start_index:
@@ -366,16 +1498,1317 @@ class GraphMap:
         path.append(start_index)
         path.reverse()
         
-        path_in_coord = [self.nodes_to_coord[node] for node in path]
+        path_in_coord = [self.node_coord(node) for node in path]
         
         return path_in_coord
     
-    def instructions_from_path(self, path):
+    def _search_state(self):
+        """ (g, pred, seen, query) of a new search, the lists are allocated once and shared by all searches.
+        
+        Entries of g / pred belong to this query only if seen carries the query number, which saves
+        resetting the lists between queries.
+        """
+        if self._g is None:
+            n = self.graph.shape[0]
+            self._g = [math.inf] * n
+            self._pred = [-9999] * n
+            self._seen = [0] * n
+        self._query += 1
+        return self._g, self._pred, self._seen, self._query
+    
+    def _alt_heuristic(self, start_index, goal_index):
+        """ Heuristic for _astar: the best landmark bound of a node, at least its octile distance """
+        bounds = self.landmarks.bounds(start_index, goal_index)
+        height = self.height
+        gx, gy = divmod(goal_index, height)
+        diagonal = math.sqrt(2) - 2
+        
+        def heuristic(v):
+            dx = abs(v // height - gx)
+            dy = abs(v % height - gy)
+            h = dx + dy + diagonal * min(dx, dy)
+            for row, to_goal in bounds:
+                b = abs(to_goal - row[v])
+                if b > h:
+                    h = b
+            return h
+        return heuristic
+    
+    def _astar(self, start_index, goal_index, heuristic=None):
+        """ A* search with octile-distance heuristic (or the given heuristic function of a node), returns the
+        predecessors or None if the goal is unreachable.
+        
+        Only the entries of the nodes reached in this query are valid in the returned predecessors.
+        """
+        g, pred, seen, query = self._search_state()
+        indptr, indices, data = self.graph.indptr, self.graph.indices, self.graph.data
+        height = self.height
+        gx, gy = divmod(goal_index, height)
+        diagonal = math.sqrt(2) - 2
+        
+        if heuristic is None:
+            def heuristic(v):
+                dx = abs(v // height - gx)
+                dy = abs(v % height - gy)
+                return dx + dy + diagonal * min(dx, dy)
+        
+        g[start_index] = 0.0
+        pred[start_index] = -9999
+        seen[start_index] = query
+        # entries (f, -g, node): ties in f are broken towards the deeper node
+        open_list = [(heuristic(start_index), -0.0, start_index)]
+        while open_list:
+            _, neg_g, v = heapq.heappop(open_list)
+            if v == goal_index:
+                return pred
+            g_v = -neg_g
+            if g_v > g[v]:
+                continue  # outdated entry, v was reached more cheaply in the meantime
+            a, b = indptr[v], indptr[v + 1]
+            for w, cost in zip(indices[a:b].tolist(), data[a:b].tolist()):
+                g_w = g_v + cost
+                if seen[w] != query or g_w < g[w]:
+                    seen[w] = query
+                    g[w] = g_w
+                    pred[w] = v
+                    heapq.heappush(open_list, (g_w + heuristic(w), -g_w, w))
+        return None
+    
+    def compress_path(self, path, shortcut=True):
+        """ Reduce a grid path to the points where its direction changes.
+        
+        With shortcut the remaining points are additionally skipped as long as the straight line
+        to a later point is free, so the path may leave the grid directions (the mecanum chassis
+        can drive in any direction without rotating).
+        """
+        if path is None or len(path) < 3:
+            return path
+        points = np.asarray(path)
+        steps = np.diff(points, axis=0)
+        turns = np.any(steps[1:] != steps[:-1], axis=1)
+        keep = np.concatenate(([True], turns, [True]))
+        corners = [tuple(p) for p in points[keep].tolist()]
+        if shortcut:
+            corners = self.map.shortcut_path(corners, self.robot_radius)
+        return corners
+    
+    def instructions_from_path(self, path, compress=False):
+        """ Relative moves (dx, dy) between the points of the path, one per grid step or,
+        with compress, one per straight segment of the compressed path """
+        if compress:
+            path = self.compress_path(path)
         instructions = []
         for i in range(1, len(path)):
             instructions.append(tuple(np.subtract(path[i], path[i - 1])))
         return instructions
         
         
+class ShortestPathTreeCache:
+    """Shortest-path trees of a GraphMap rooted at frequently used goals (seats, home position).
+    
+    Since the graph is undirected, the predecessors of a tree rooted at the goal lead from any start
+    back to the goal, so a query only walks the path. Trees are evicted least recently used first once
+    their total size exceeds max_bytes and are dropped when the map changes.
+    """
+    def __init__(self, graph_map, max_bytes=64 * 2**20):
+        self.graph_map = graph_map
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._trees = OrderedDict()
+        self._version = graph_map.map_version
+    
+    def __len__(self):
+        return len(self._trees)
+    
+    def __contains__(self, root):
+        return self._root_index(root) in self._trees
+    
+    def clear(self):
+        self._trees.clear()
+        self.nbytes = 0
+    
+    def _root_index(self, root):
+        return self.graph_map.node_index((round(root[0]), round(root[1])))
+    
+    def _check_version(self):
+        self.graph_map.refresh()
+        if self._version != self.graph_map.map_version:
+            self.clear()
+            self._version = self.graph_map.map_version
+    
+    def _insert(self, root_index, dist, pred):
+        tree = (dist.astype(np.float32), pred.astype(np.int32))
+        self._trees[root_index] = tree
+        self.nbytes += tree[0].nbytes + tree[1].nbytes
+        # evict least recently used trees, the new one is always kept
+        while self.nbytes > self.max_bytes and len(self._trees) > 1:
+            _, (old_dist, old_pred) = self._trees.popitem(last=False)
+            self.nbytes -= old_dist.nbytes + old_pred.nbytes
+        return tree
+    
+    def tree(self, root):
+        """ (dist, pred) arrays of the shortest-path tree rooted at the grid point root """
+        self._check_version()
+        root_index = self._root_index(root)
+        if root_index in self._trees:
+            self._trees.move_to_end(root_index)
+            return self._trees[root_index]
+        dist, pred = csg.shortest_path(self.graph_map.graph, directed = False, indices = root_index, return_predecessors = True)
+        return self._insert(root_index, dist, pred)
+    
+    def precompute(self, extra_roots=()):
+        """ Compute the trees of all seats of the map and of extra_roots (e.g. the home position) in one go """
+        self._check_version()
+        roots = [(s.x, s.y) for s in self.graph_map.map.seats] + list(extra_roots)
+        missing = list(dict.fromkeys(i for i in map(self._root_index, roots) if i not in self._trees))
+        if missing:
+            dist, pred = csg.shortest_path(self.graph_map.graph, directed = False, indices = missing, return_predecessors = True)
+            for i, root_index in enumerate(missing):
+                self._insert(root_index, dist[i], pred[i])
+    
+    def distance(self, start, goal):
+        """ Length of the shortest path from start to goal, inf if there is none """
+        dist, _ = self.tree(goal)
+        return float(dist[self._root_index(start)])
+    
+    def path_from_to(self, start, goal):
+        """ Shortest path from start to goal as list of grid points, read off the tree rooted at goal """
+        dist, pred = self.tree(goal)
+        start = (round(start[0]), round(start[1]))
+        start_index = self.graph_map.node_index(start)
+        goal_index = self.graph_map.node_index(goal)
+        
+        # no path found - should never happen if map is well defined
+        if np.isinf(dist[start_index]):
+            raise ValueError(f"No connection from {start} to {goal}")
+        
+        # predecessors point towards the root, so the walk yields the path already in order
+        path = [start_index]
+        v = start_index
+        while v != goal_index:
+            v = pred[v]
+            if v == -9999:
+                raise ValueError("Broken predecessor chain – graph is disconnected.")
+            path.append(v)
+        
+        return [self.graph_map.node_coord(node) for node in path]
+        
+
+
+class FlowFieldCache:
+    """Flow fields of a GraphMap towards fixed goals (the seats by default) for O(1) next-step lookups.
+    
+    The field of a goal is its distance raster (float32, inf where the goal is unreachable) and a
+    direction raster (int8 index into GraphMap.HEADINGS of the next move, -1 at the goal and where it is
+    unreachable), both indexed [x, y]. Fields are computed on first use and dropped when the map changes.
+    """
+    def __init__(self, graph_map):
+        self.graph_map = graph_map
+        self._fields = {}
+        self._version = graph_map.map_version
+    
+    def __len__(self):
+        return len(self._fields)
+    
+    def __contains__(self, goal):
+        return self._goal_index(goal) in self._fields
+    
+    @property
+    def nbytes(self):
+        return sum(dist.nbytes + direction.nbytes for dist, direction in self._fields.values())
+    
+    def clear(self):
+        self._fields.clear()
+    
+    def load_fields(self, goals, dist, direction):
+        """ Use precomputed fields (e.g. of a compiled map) towards the grid points goals, dist and direction
+        are stacked as (goals, width, height) arrays """
+        self._check_version()
+        shape = (len(goals), self.graph_map.width, self.graph_map.height)
+        if dist.shape != shape or direction.shape != shape:
+            raise ValueError(f"Fields of shape {dist.shape} and {direction.shape} do not fit {shape}")
+        for goal, goal_dist, goal_direction in zip(goals, dist, direction):
+            self._fields[self._goal_index(goal)] = (goal_dist, goal_direction)
+    
+    def _goal_index(self, goal):
+        return self.graph_map.node_index((round(goal[0]), round(goal[1])))
+    
+    def _cell(self, position):
+        """ Grid point next to position, raises KeyError outside of the map """
+        return self.graph_map.node_coord(self._goal_index(position))
+    
+    def _check_version(self):
+        self.graph_map.refresh()
+        if self._version != self.graph_map.map_version:
+            self.clear()
+            self._version = self.graph_map.map_version
+    
+    def _build(self, goal_indices):
+        graph_map = self.graph_map
+        shape = (graph_map.width, graph_map.height)
+        dist, pred = csg.shortest_path(graph_map.graph, directed = False, indices = goal_indices, return_predecessors = True)
+        for goal_index, goal_dist, goal_pred in zip(goal_indices, np.atleast_2d(dist), np.atleast_2d(pred)):
+            # predecessors point towards the goal, the direction is the offset to the predecessor
+            nodes = np.flatnonzero(goal_pred >= 0)
+            dx = goal_pred[nodes] // graph_map.height - nodes // graph_map.height
+            dy = goal_pred[nodes] % graph_map.height - nodes % graph_map.height
+            direction = np.full(len(goal_pred), -1, dtype=np.int8)
+            direction[nodes] = GraphMap.HEADING_INDEX[dx + 1, dy + 1]
+            self._fields[goal_index] = (goal_dist.astype(np.float32).reshape(shape), direction.reshape(shape))
+    
+    def field(self, goal):
+        """ (dist, direction) rasters of the flow field towards the grid point goal """
+        self._check_version()
+        goal_index = self._goal_index(goal)
+        if goal_index not in self._fields:
+            self._build([goal_index])
+        return self._fields[goal_index]
+    
+    def precompute(self, extra_goals=()):
+        """ Compute the fields of all seats of the map and of extra_goals in one go """
+        self._check_version()
+        goals = [(s.x, s.y) for s in self.graph_map.map.seats] + list(extra_goals)
+        missing = list(dict.fromkeys(i for i in map(self._goal_index, goals) if i not in self._fields))
+        if missing:
+            self._build(missing)
+    
+    def next_step(self, position, goal):
+        """ Move (dx, dy) from the grid point next to position towards goal, None at the goal or if it is unreachable """
+        _, direction = self.field(goal)
+        k = direction[self._cell(position)]
+        return GraphMap.HEADINGS[k] if k >= 0 else None
+    
+    def distance(self, position, goal):
+        """ Length of the shortest path from position to goal, inf if there is none """
+        dist, _ = self.field(goal)
+        return float(dist[self._cell(position)])
+    
+    def path_from_to(self, start, goal):
+        """ Shortest path from start to goal as list of grid points by following the flow field """
+        dist, direction = self.field(goal)
+        x, y = self._cell(start)
+        if np.isinf(dist[x, y]):
+            raise ValueError(f"No connection from {start} to {goal}")
+        path = [(x, y)]
+        k = direction[x, y]
+        while k >= 0:
+            dx, dy = GraphMap.HEADINGS[k]
+            x, y = x + dx, y + dy
+            path.append((x, y))
+            k = direction[x, y]
+        return path
+
+
+class Landmarks:
+    """ALT (A*, landmarks, triangle inequality) heuristic of a GraphMap for method "alt".
+
+    count landmark nodes are picked by farthest-point selection, each new one is the node farthest
+    from those already chosen, and their distances to all nodes are kept as float32 (count, nodes)
+    table. For a landmark L, |d(L, goal) - d(L, v)| is a lower bound of the distance from v to the goal
+    which is much tighter than the octile distance behind tables. The table is recomputed when the
+    graph changes. With path given it is loaded from that .npz file if it was saved for the same map
+    and graph parameters, otherwise it is computed and saved there. nodes and distances may also be
+    given precomputed for the current graph (see load_compiled_map).
+    """
+    def __init__(self, graph_map, count=8, active=4, path=None, nodes=None, distances=None):
+        self.graph_map = graph_map
+        # landmarks used per query, the ones giving the best bound between start and goal
+        self.active = active
+        self.path = path
+        self.nodes = None
+        self.distances = None
+        self._version = None
+        if nodes is not None:
+            if distances.shape != (len(nodes), graph_map.width * graph_map.height):
+                raise ValueError(f"Landmark table of shape {distances.shape} does not fit {len(nodes)} landmarks")
+            graph_map.refresh()
+            count = len(nodes)
+            self.nodes, self.distances = nodes, distances
+            self._version = graph_map.graph_version
+        self.count = count
+
+    @property
+    def nbytes(self):
+        return 0 if self.distances is None else self.distances.nbytes
+
+    def _params(self):
+        g = self.graph_map
+        return np.array([g.width, g.height, g.robot_radius, g.clearance_cost, g.clearance_range, self.count], dtype=float)
+
+    def update(self):
+        """ Select the landmarks and compute their distances if the graph changed since (or on first use) """
+        self.graph_map.refresh()
+        if self._version == self.graph_map.graph_version:
+            return
+        if self._version is not None or self.path is None or not self.load(self.path):
+            self._select()
+            if self._version is None and self.path is not None:
+                self.save(self.path)
+        self._version = self.graph_map.graph_version
+
+    def _select(self):
+        graph = self.graph_map.graph
+        # start from the node farthest from the node with most edges (somewhere in open space)
+        start = int(np.argmax(np.diff(graph.indptr)))
+        nearest = csg.shortest_path(graph, directed=False, indices=start)
+        nodes, rows = [], []
+        for _ in range(self.count):
+            reachable = np.isfinite(nearest)
+            node = int(np.argmax(np.where(reachable, nearest, -1)))
+            if nodes and nearest[node] == 0:
+                break  # fewer reachable nodes than landmarks
+            dist = csg.shortest_path(graph, directed=False, indices=node)
+            nodes.append(node)
+            rows.append(dist.astype(np.float32))
+            nearest = np.minimum(nearest, dist) if nodes[1:] else dist
+        self.nodes = np.array(nodes, dtype=np.int64)
+        self.distances = np.stack(rows)
+
+    def save(self, path):
+        np.savez(path, params=self._params(), obstacles=self.graph_map.map.obstacle_bounds(),
+                 nodes=self.nodes, distances=self.distances)
+
+    def load(self, path):
+        """ Read landmarks saved for the same map and graph parameters, returns False if there are none """
+        try:
+            with np.load(path) as data:
+                if not (np.array_equal(data["params"], self._params())
+                        and np.array_equal(data["obstacles"], self.graph_map.map.obstacle_bounds())):
+                    return False
+                self.nodes, self.distances = data["nodes"], data["distances"]
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def bounds(self, start_index, goal_index):
+        """ (distances of all nodes, distance to the goal) of the active landmarks for a query.
+        
+        The landmarks are the ones giving the best bound between start and goal, |d(L, goal) - d(L, v)|
+        is then the bound of node v. Only landmarks connected to the goal are used.
+        """
+        self.update()
+        d = self.distances
+        to_goal = d[:, goal_index].astype(float)
+        connected = np.flatnonzero(np.isfinite(to_goal))
+        gain = np.abs(to_goal[connected] - d[connected, start_index])
+        rows = connected[np.argsort(gain)[-self.active:]]
+        # memoryviews of the rows give python floats by index without numpy overhead
+        return [(memoryview(d[r]), to_goal[r]) for r in rows.tolist()]
+
+
+class RouteOptimizer:
+    """Visiting order for delivering to several seats in one round with the least driving time.
+    
+    The times between the points are the fastest driving times including the turns, found by a search
+    over the heading graph of the GraphMap (see GraphMap.heading_graph) with a free heading at the start
+    of each leg; the turn at a seat between two legs is not counted. The times between all seats of
+    the map are cached per graph version. Up to exact_limit seats the order is solved exactly
+    (Held-Karp dynamic programming), for more seats by nearest neighbour followed by 2-opt improvements.
+    """
+    def __init__(self, graph_map, exact_limit=10):
+        self.graph_map = graph_map
+        self.exact_limit = exact_limit
+        self._matrix = None
+        self._version = None
+    
+    def _times_from(self, point):
+        """ Fastest driving time in seconds from point (any heading) to every node (any heading) """
+        sources = self.graph_map.node_index(point) * 8 + np.arange(8)
+        dist = csg.dijkstra(self.graph_map.heading_graph(), directed=True, indices=sources, min_only=True)
+        return dist.reshape(-1, 8).min(axis=1)
+    
+    def seat_matrix(self):
+        """ (seat points, driving time matrix) of all seats of the map """
+        self.graph_map.refresh()
+        if self._version != self.graph_map.graph_version:
+            points = [(s.x, s.y) for s in self.graph_map.map.seats]
+            indices = [self.graph_map.node_index(p) for p in points]
+            self._matrix = (points, np.array([self._times_from(p)[indices] for p in points], dtype=float).reshape(len(points), -1))
+            self._version = self.graph_map.graph_version
+        return self._matrix
+    
+    def _distances(self, start, seats, end):
+        """ Driving time matrix over [start] + seats (+ [end]) """
+        points, matrix = self.seat_matrix()
+        lookup = {p: i for i, p in enumerate(points)}
+        nodes = [start] + seats + ([end] if end is not None else [])
+        indices = [self.graph_map.node_index(p) for p in nodes]
+        d = np.empty((len(nodes), len(nodes)))
+        known = [i for i, p in enumerate(nodes) if 0 < i <= len(seats) and p in lookup]
+        d[np.ix_(known, known)] = matrix[np.ix_([lookup[nodes[i]] for i in known], [lookup[nodes[i]] for i in known])]
+        # driving a path backwards takes as long (same moves and turns, reversed headings), so the
+        # times from a node give its row and column
+        for j in sorted(set(range(len(nodes))) - set(known)):
+            d[:, j] = d[j, :] = self._times_from(nodes[j])[indices]
+        return d
+    
+    def order(self, start, seats, end=None):
+        """ Seats (grid points or Seat objects) in the order with the fastest round from start, optionally ending at end """
+        start = (round(start[0]), round(start[1]))
+        seats = list(dict.fromkeys((s.x, s.y) if isinstance(s, Seat) else tuple(s) for s in seats))
+        if not seats:
+            return []
+        d = self._distances(start, seats, end)
+        if np.isinf(d).any():
+            raise ValueError(f"Not all of the seats {seats} can be reached from {start}")
+        last = len(seats) + 1 if end is not None else None
+        if len(seats) <= self.exact_limit:
+            tour = self._held_karp(d, last)
+        else:
+            tour = self._two_opt(d, self._nearest_neighbor(d, last), last)
+        return [seats[i - 1] for i in tour]
+    
+    def route(self, start, seats, end=None):
+        """ (seat order, concatenated path, instructions) of the fastest round through the seats """
+        order = self.order(start, seats, end)
+        stops = [(round(start[0]), round(start[1]))] + order + ([end] if end is not None else [])
+        path = [stops[0]]
+        for a, b in zip(stops, stops[1:]):
+            path += self.graph_map.path_from_to(a, b, method="time")[1:]
+        return order, path, self.graph_map.instructions_from_path(path)
+    
+    @staticmethod
+    def _length(d, tour, last):
+        nodes = [0] + tour + ([last] if last is not None else [])
+        return sum(d[a, b] for a, b in zip(nodes, nodes[1:]))
+    
+    @staticmethod
+    def _held_karp(d, last):
+        """ Exact order of the nodes 1..n starting at node 0 and ending at node last (if given) """
+        n = d.shape[0] - 1 - (last is not None)
+        # best[mask][j]: shortest way from 0 through the nodes in mask ending at node j + 1
+        best = {(1 << j, j): (d[0, j + 1], None) for j in range(n)}
+        for mask in range(1, 1 << n):
+            for j in range(n):
+                if (mask, j) not in best:
+                    continue
+                cost = best[(mask, j)][0]
+                for k in range(n):
+                    if mask & (1 << k):
+                        continue
+                    key = (mask | 1 << k, k)
+                    if key not in best or cost + d[j + 1, k + 1] < best[key][0]:
+                        best[key] = (cost + d[j + 1, k + 1], j)
+        full = (1 << n) - 1
+        final = [best[(full, j)][0] + (d[j + 1, last] if last is not None else 0) for j in range(n)]
+        j, mask, tour = int(np.argmin(final)), full, []
+        while j is not None:
+            tour.append(j + 1)
+            j, mask = best[(mask, j)][1], mask & ~(1 << j)
+        return tour[::-1]
+    
+    @staticmethod
+    def _nearest_neighbor(d, last):
+        n = d.shape[0] - 1 - (last is not None)
+        tour, current = [], 0
+        left = set(range(1, n + 1))
+        while left:
+            current = min(left, key=lambda k: d[current, k])
+            tour.append(current)
+            left.remove(current)
+        return tour
+    
+    @classmethod
+    def _two_opt(cls, d, tour, last):
+        """ Reverse parts of the tour as long as that shortens it """
+        nodes = [0] + tour + ([last] if last is not None else [])
+        improved = True
+        while improved:
+            improved = False
+            for i in range(1, len(tour) + 1):
+                for j in range(i + 1, len(tour) + 1):
+                    # reversing nodes[i..j] replaces the edges (i - 1, i) and (j, j + 1)
+                    after = d[nodes[j], nodes[j + 1]] if j + 1 < len(nodes) else 0
+                    reversed_after = d[nodes[i], nodes[j + 1]] if j + 1 < len(nodes) else 0
+                    delta = d[nodes[i - 1], nodes[j]] + reversed_after - d[nodes[i - 1], nodes[i]] - after
+                    if delta < -1e-9:
+                        nodes[i:j + 1] = nodes[i:j + 1][::-1]
+                        improved = True
+        return nodes[1:len(tour) + 1]
+
+
+class JumpPointSearch:
+    """Jump Point Search on the occupancy raster of a Map, same moves and costs as the 8-connected GraphMap.
+    
+    Straight and diagonal runs through free space are skipped by jumping until a point with a forced
+    neighbor (next to an obstacle corner) or the goal is found, only these jump points enter the open
+    list. No graph is built, the search works on a flat copy of the free-space raster with a blocked
+    border, node (x, y) has index (x + 1) * (height + 2) + y + 1. The robot radius blocks grid points
+    like in GraphMap, a soft clearance cost is not supported since it breaks the uniform costs.
+    """
+    def __init__(self, map: Map, robot_radius=0.0):
+        self.map = map
+        self.width = map.width
+        self.height = map.height
+        self.robot_radius = robot_radius
+        self.map_version = None
+        self.refresh()
+    
+    def refresh(self):
+        """ Update the raster if the obstacles of the map changed """
+        if self.map_version != self.map.version:
+            free = np.pad(self.map.free_grid(self.robot_radius), 1, constant_values=False)
+            self.free = free.ravel().tobytes()
+            self.map_version = self.map.version
+    
+    def _index(self, coord):
+        x, y = coord
+        if x != int(x) or y != int(y) or not self.map.in_map(x, y):
+            raise KeyError(coord)
+        return (int(x) + 1) * (self.height + 2) + int(y) + 1
+    
+    def _coord(self, index):
+        return (index // (self.height + 2) - 1, index % (self.height + 2) - 1)
+    
+    def path_from_to(self, start, goal):
+        """ Shortest path from start to goal as list of grid points, like GraphMap.path_from_to """
+        self.refresh()
+        start = (round(start[0]), round(start[1]))
+        start_index, goal_index = self._index(start), self._index(goal)
+        free, row = self.free, self.height + 2
+        gx, gy = divmod(goal_index, row)
+        
+        def heuristic(v):
+            dx, dy = abs(v // row - gx), abs(v % row - gy)
+            return max(dx, dy) + (math.sqrt(2) - 1) * min(dx, dy)
+        
+        if free[start_index] and free[goal_index]:
+            g = {start_index: 0.0}
+            parent = {start_index: None}
+            open_list = [(heuristic(start_index), 0.0, start_index)]
+            while open_list:
+                _, g_v, v = heapq.heappop(open_list)
+                if v == goal_index:
+                    return self._expand(parent, goal_index)
+                if g_v > g[v]:
+                    continue  # outdated entry
+                for dx, dy in self._directions(v, parent[v]):
+                    w = self._jump(v, dx, dy, goal_index)
+                    if w < 0:
+                        continue
+                    # jump points lie on a straight or diagonal line from v
+                    steps = max(abs(w // row - v // row), abs(w % row - v % row))
+                    g_w = g_v + steps * (math.sqrt(2) if dx and dy else 1.0)
+                    if g_w < g.get(w, math.inf):
+                        g[w] = g_w
+                        parent[w] = v
+                        heapq.heappush(open_list, (g_w + heuristic(w), g_w, w))
+        raise ValueError(f"No connection from {start} to {goal}")
+    
+    def _directions(self, v, p):
+        """ Directions to search from v when it was reached from p (pruned neighbors plus forced neighbors) """
+        free, row = self.free, self.height + 2
+        if p is None:
+            return [(dx, dy) for (dx, dy), _ in GraphMap.NEIGHBORS if free[v + dx * row + dy]]
+        x, y = divmod(v, row)
+        px, py = divmod(p, row)
+        dx, dy = (x > px) - (x < px), (y > py) - (y < py)
+        directions = []
+        if dx and dy:
+            directions += [(dx, 0), (0, dy), (dx, dy)]
+            if not free[v - dx * row]:
+                directions.append((-dx, dy))
+            if not free[v - dy]:
+                directions.append((dx, -dy))
+        elif dx:
+            directions.append((dx, 0))
+            if not free[v + 1]:
+                directions.append((dx, 1))
+            if not free[v - 1]:
+                directions.append((dx, -1))
+        else:
+            directions.append((0, dy))
+            if not free[v + row]:
+                directions.append((1, dy))
+            if not free[v - row]:
+                directions.append((-1, dy))
+        return [(dx, dy) for dx, dy in directions if free[v + dx * row + dy]]
+    
+    def _jump(self, v, dx, dy, goal_index):
+        """ Next jump point from v in direction (dx, dy) or -1 if the run ends at an obstacle """
+        free, row = self.free, self.height + 2
+        step = dx * row + dy
+        while True:
+            v += step
+            if not free[v]:
+                return -1
+            if v == goal_index:
+                return v
+            if dx and dy:
+                # forced neighbors behind the corners of the move, or a jump point in a straight direction
+                if (free[v - dx * row + dy] and not free[v - dx * row]) or (free[v + dx * row - dy] and not free[v - dy]):
+                    return v
+                if self._jump(v, dx, 0, goal_index) >= 0 or self._jump(v, 0, dy, goal_index) >= 0:
+                    return v
+            elif dx:
+                if (free[v + step + 1] and not free[v + 1]) or (free[v + step - 1] and not free[v - 1]):
+                    return v
+            else:
+                if (free[v + step + row] and not free[v + row]) or (free[v + step - row] and not free[v - row]):
+                    return v
+    
+    def _expand(self, parent, goal_index):
+        """ Grid path through the jump points leading to goal_index """
+        jump_points = []
+        v = goal_index
+        while v is not None:
+            jump_points.append(self._coord(v))
+            v = parent[v]
+        jump_points.reverse()
+        path = [jump_points[0]]
+        for (x0, y0), (x1, y1) in zip(jump_points, jump_points[1:]):
+            dx, dy = (x1 > x0) - (x1 < x0), (y1 > y0) - (y1 < y0)
+            for k in range(1, max(abs(x1 - x0), abs(y1 - y0)) + 1):
+                path.append((x0 + k * dx, y0 + k * dy))
+        return path
+
+
+class HierarchicalMap:
+    """Hierarchical path finding (HPA*) on a GraphMap for large maps with several rooms.
+    
+    The grid is split into square clusters of cluster_size cells. Where the border of two neighboring
+    clusters is free on both sides there are entrances (one in the middle of short free runs, one at each
+    end of long ones), the distances and paths between the entrances of a cluster are precomputed. A query
+    searches the cells of the start and goal clusters only and then the small abstract graph of the
+    entrances, the rest of the path is put together from the precomputed paths. Paths are close to but
+    not always exactly the shortest.
+    
+    Changes made through GraphMap.add_obstacle etc. are picked up from GraphMap.changes, only the clusters
+    touched by a change (and their neighbors if their entrances changed) are recomputed.
+    """
+    def __init__(self, graph_map, cluster_size=10):
+        self.graph_map = graph_map
+        self.cluster_size = cluster_size
+        self._rebuild()
+    
+    def _rebuild(self):
+        graph_map = self.graph_map
+        graph_map.refresh()
+        self._graph_version = graph_map.graph_version
+        self.num_x = -(-graph_map.width // self.cluster_size)
+        self.num_y = -(-graph_map.height // self.cluster_size)
+        # abstract graph as adjacency dicts node index -> {node index: distance}
+        self.edges = {}
+        # entrances of the border between cluster (cx, cy) and (cx + 1, cy) under key (0, cx, cy),
+        # between (cx, cy) and (cx, cy + 1) under (1, cx, cy), as list of (node, node) pairs
+        self.entrances = {}
+        for cx in range(self.num_x):
+            for cy in range(self.num_y):
+                for key in ((0, cx, cy), (1, cx, cy)):
+                    self._find_entrances(key)
+        self.clusters = {}
+        for cx in range(self.num_x):
+            for cy in range(self.num_y):
+                self._build_cluster((cx, cy))
+    
+    def cluster_of(self, index):
+        """ Cluster (cx, cy) of a node index of the graph """
+        x, y = divmod(int(index), self.graph_map.height)
+        return (x // self.cluster_size, y // self.cluster_size)
+    
+    def _cluster_range(self, cluster):
+        c = self.cluster_size
+        return (cluster[0] * c, min((cluster[0] + 1) * c, self.graph_map.width),
+                cluster[1] * c, min((cluster[1] + 1) * c, self.graph_map.height))
+    
+    def _find_entrances(self, key):
+        """ Recompute the entrances of one border """
+        axis, cx, cy = key
+        if (axis == 0 and cx + 1 >= self.num_x) or (axis == 1 and cy + 1 >= self.num_y):
+            return
+        free, height = self.graph_map.free, self.graph_map.height
+        x0, x1, y0, y1 = self._cluster_range((cx, cy))
+        if axis == 0:
+            along = np.arange(y0, y1)
+            a = (x1 - 1) * height + along
+            b = x1 * height + along
+            open_ = free[x1 - 1, y0:y1] & free[x1, y0:y1]
+        else:
+            along = np.arange(x0, x1)
+            a = along * height + y1 - 1
+            b = along * height + y1
+            open_ = free[x0:x1, y1 - 1] & free[x0:x1, y1]
+        # runs of cells that are free on both sides of the border
+        edges = np.diff(np.concatenate(([0], open_.astype(np.int8), [0])))
+        pairs = []
+        for first, end in zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()):
+            if end - first < 6:
+                picks = [(first + end - 1) // 2]
+            else:
+                picks = [first, end - 1]
+            pairs += [(int(a[k]), int(b[k])) for k in picks]
+        for u, v in self.entrances.get(key, ()):
+            self._set_edge(u, v, None)
+        for u, v in pairs:
+            self._set_edge(u, v, 1.0)
+        self.entrances[key] = pairs
+    
+    def _set_edge(self, u, v, cost):
+        """ Set the cost of the abstract edge u - v, None removes it """
+        for a, b in ((u, v), (v, u)):
+            if cost is None:
+                self.edges[a].pop(b, None)
+                if not self.edges[a]:
+                    del self.edges[a]
+            else:
+                self.edges.setdefault(a, {})[b] = cost
+    
+    def _borders(self, cluster):
+        cx, cy = cluster
+        return [(0, cx, cy), (0, cx - 1, cy), (1, cx, cy), (1, cx, cy - 1)]
+    
+    def _cluster_entrances(self, cluster):
+        """ Sorted node indices of the entrances lying in the cluster """
+        nodes = set()
+        for key in self._borders(cluster):
+            for a, b in self.entrances.get(key, ()):
+                nodes.add(a if self.cluster_of(a) == cluster else b)
+        return sorted(nodes)
+    
+    def _build_cluster(self, cluster):
+        """ Subgraph of the cluster and the distances and shortest-path trees between its entrances """
+        x0, x1, y0, y1 = self._cluster_range(cluster)
+        height = self.graph_map.height
+        nodes = (np.arange(x0, x1)[:, None] * height + np.arange(y0, y1)[None, :]).ravel()
+        subgraph = self.graph_map.graph[nodes][:, nodes]
+        entrances = self._cluster_entrances(cluster)
+        local = [self._local(cluster, e) for e in entrances]
+        if local:
+            dist, pred = csg.dijkstra(subgraph, directed=False, indices=local, return_predecessors=True)
+        else:
+            dist = np.zeros((0, len(nodes)))
+            pred = np.zeros((0, len(nodes)), dtype=np.int32)
+        
+        # replace the edges between the entrances of the cluster
+        old = self.clusters.get(cluster)
+        if old is not None:
+            for i, u in enumerate(old["entrances"]):
+                for v in old["entrances"][i + 1:]:
+                    if v in self.edges.get(u, ()):
+                        self._set_edge(u, v, None)
+        for i, j in zip(*np.nonzero(np.isfinite(dist[:, local]))):
+            if i < j:
+                self._set_edge(entrances[i], entrances[j], float(dist[i, local[j]]))
+        self.clusters[cluster] = {"nodes": nodes, "graph": subgraph, "entrances": entrances, "pred": pred}
+    
+    def _local(self, cluster, index):
+        """ Index of a node within the subgraph of its cluster """
+        x0, x1, y0, y1 = self._cluster_range(cluster)
+        x, y = divmod(int(index), self.graph_map.height)
+        return (x - x0) * (y1 - y0) + y - y0
+    
+    def _sync(self):
+        """ Recompute the clusters touched by the graph changes since the last call """
+        graph_map = self.graph_map
+        graph_map.refresh()
+        version = graph_map.graph_version
+        if version == self._graph_version:
+            return
+        changes = [nodes for v, nodes in graph_map.changes if v > self._graph_version]
+        if len(changes) != version - self._graph_version:
+            # full rebuild of the graph or changes no longer logged
+            self._rebuild()
+            return
+        touched = {self.cluster_of(v) for nodes in changes for v in nodes.tolist()}
+        before = {c: self._cluster_entrances(c) for t in touched for c in self._with_neighbors(t)}
+        for key in {key for c in touched for key in self._borders(c)}:
+            if key in self.entrances:
+                self._find_entrances(key)
+        for c in before:
+            if c in touched or self._cluster_entrances(c) != before[c]:
+                self._build_cluster(c)
+        self._graph_version = version
+    
+    def _with_neighbors(self, cluster):
+        cx, cy = cluster
+        return [(x, y) for x, y in ((cx, cy), (cx - 1, cy), (cx + 1, cy), (cx, cy - 1), (cx, cy + 1))
+                if 0 <= x < self.num_x and 0 <= y < self.num_y]
+    
+    def path_from_to(self, start, goal):
+        """ Path from start to goal as list of grid points, like GraphMap.path_from_to """
+        self._sync()
+        start = (round(start[0]), round(start[1]))
+        s = self.graph_map.node_index(start)
+        t = self.graph_map.node_index(goal)
+        cs, ct = self.cluster_of(s), self.cluster_of(t)
+        
+        # cell level search in the start and goal cluster only
+        dist_s, pred_s = csg.dijkstra(self.clusters[cs]["graph"], directed=False, indices=self._local(cs, s),
+                                      return_predecessors=True)
+        dist_t, pred_t = csg.dijkstra(self.clusters[ct]["graph"], directed=False, indices=self._local(ct, t),
+                                      return_predecessors=True)
+        
+        # within one cluster the direct path competes with leaving the cluster and coming back
+        direct = dist_s[self._local(ct, t)] if cs == ct else math.inf
+        entrances = self._abstract_search(
+            {e: dist_s[self._local(cs, e)] for e in self.clusters[cs]["entrances"]},
+            {e: dist_t[self._local(ct, e)] for e in self.clusters[ct]["entrances"]}, t, direct)
+        if entrances is None:
+            if np.isfinite(direct):
+                return self._cluster_path(cs, pred_s, t)[::-1]
+            raise ValueError(f"No connection from {start} to {goal}")
+        
+        path = self._cluster_path(cs, pred_s, entrances[0])[::-1]
+        for a, b in zip(entrances, entrances[1:]):
+            c = self.cluster_of(a)
+            if c == self.cluster_of(b):
+                # precomputed path within the cluster
+                row = self.clusters[c]["entrances"].index(a)
+                path += self._cluster_path(c, self.clusters[c]["pred"][row], b)[::-1][1:]
+            else:
+                path.append(self.graph_map.node_coord(b))
+        path += self._cluster_path(ct, pred_t, entrances[-1])[1:]
+        return path
+    
+    def _cluster_path(self, cluster, pred, index):
+        """ Grid points from index back to the root of the shortest-path tree pred of the cluster """
+        nodes = self.clusters[cluster]["nodes"]
+        path = []
+        v = self._local(cluster, index)
+        while v >= 0:
+            path.append(self.graph_map.node_coord(nodes[v]))
+            v = pred[v]
+        return path
+    
+    def _abstract_search(self, sources, targets, goal_index, bound=math.inf):
+        """ A* on the abstract graph from the sources to the targets (both entrance node -> distance),
+        returns the entrance nodes of the path or None if there is no path shorter than bound """
+        edges = self.edges
+        height = self.graph_map.height
+        gx, gy = divmod(goal_index, height)
+        
+        def heuristic(a):
+            dx, dy = divmod(a, height)
+            dx, dy = abs(dx - gx), abs(dy - gy)
+            return max(dx, dy) + (math.sqrt(2) - 1) * min(dx, dy)
+        
+        g, parent = {}, {}
+        open_list = []
+        for a, d in sources.items():
+            if np.isfinite(d):
+                g[a], parent[a] = d, None
+                heapq.heappush(open_list, (d + heuristic(a), d, a))
+        # goal is the virtual node -1 reached from the targets
+        while open_list:
+            f_v, g_v, v = heapq.heappop(open_list)
+            if f_v >= bound:
+                break
+            if v == -1:
+                path = []
+                v = parent[-1]
+                while v is not None:
+                    path.append(v)
+                    v = parent[v]
+                return path[::-1]
+            if g_v > g[v]:
+                continue
+            if v in targets and np.isfinite(targets[v]) and g_v + targets[v] < g.get(-1, math.inf):
+                g[-1], parent[-1] = g_v + targets[v], v
+                heapq.heappush(open_list, (g[-1], g[-1], -1))
+            for w, cost in edges.get(v, {}).items():
+                g_w = g_v + cost
+                if g_w < g.get(w, math.inf):
+                    g[w], parent[w] = g_w, v
+                    heapq.heappush(open_list, (g_w + heuristic(w), g_w, w))
+        return None
+
+
+class CooperativePlanner:
+    """Prioritized planning of collision-free, time-indexed paths for several robots on a GraphMap.
+    
+    Robots are planned one after the other with a space-time A* (one move or waiting per time step)
+    that avoids the cells and moves reserved by the robots planned before: no two robots are in the same
+    cell at the same time step, swap cells or cross each other diagonally, and robots stay at their goal
+    once they arrived. The distance in steps to the goal (a breadth-first search on the graph) is used as
+    heuristic, so the search expands little more than the cells of the final path.
+    """
+    def __init__(self, graph_map, max_wait=None):
+        self.graph_map = graph_map
+        # time steps a robot may spend waiting in total before its planning fails, default width + height
+        self.max_wait = max_wait
+    
+    def plan(self, starts, goals):
+        """ Paths (lists of grid points, one per time step) of all robots from starts to goals in order of priority.
+        
+        Raises ValueError if a robot can not reach its goal without collision.
+        """
+        self.graph_map.refresh()
+        if len(starts) != len(goals):
+            raise ValueError("Number of starts and goals differ")
+        starts = [self.graph_map.node_index((round(s[0]), round(s[1]))) for s in starts]
+        goals = [self.graph_map.node_index(g) for g in goals]
+        if len(set(starts)) != len(starts) or len(set(goals)) != len(goals):
+            raise ValueError("Robots share a start or a goal")
+        
+        steps = csg.shortest_path(self.graph_map.graph, directed=False, unweighted=True, indices=goals)
+        graph = self.graph_map.graph
+        neighbors = np.split(graph.indices, graph.indptr[1:-1])
+        # reserved (node, t), reserved moves (u, v, t) from u at t to v at t + 1, time from which a
+        # node is occupied by a parked robot and the last time step at which a node is reserved
+        self._cells, self._moves, self._parked, self._last = set(), set(), {}, {}
+        # the start of every robot is occupied at t = 0
+        self._cells.update((s, 0) for s in starts)
+        paths = []
+        for robot, (start, goal) in enumerate(zip(starts, goals)):
+            path = self._search(start, goal, steps[robot], neighbors)
+            if path is None:
+                raise ValueError(f"No collision-free path for robot {robot} from "
+                                 f"{self.graph_map.node_coord(start)} to {self.graph_map.node_coord(goal)}")
+            self._reserve(path)
+            paths.append([self.graph_map.node_coord(v) for v in path])
+        return paths
+    
+    def _blocked(self, u, v, t):
+        """ Whether the move (or wait if u == v) from u at t to v at t + 1 collides with a reservation """
+        if (v, t + 1) in self._cells or self._parked.get(v, math.inf) <= t + 1:
+            return True
+        # swapping cells, diagonal moves also reserve the crossing diagonal in both directions
+        return u != v and ((v, u, t) in self._moves or (u, v, t) in self._moves)
+    
+    def _reserve(self, path):
+        height = self.graph_map.height
+        for t, v in enumerate(path):
+            self._cells.add((v, t))
+            self._last[v] = max(self._last.get(v, 0), t)
+        for t, (u, v) in enumerate(zip(path, path[1:])):
+            if u != v:
+                self._moves.add((u, v, t))
+                dx, dy = v // height - u // height, v % height - u % height
+                if dx and dy:
+                    self._moves.add((u + dx * height, u + dy, t))
+                    self._moves.add((u + dy, u + dx * height, t))
+        self._parked[path[-1]] = len(path) - 1
+    
+    def _search(self, start, goal, steps, neighbors):
+        """ Space-time A* from start at t = 0 to goal, returns the node of every time step or None """
+        if np.isinf(steps[start]):
+            return None
+        max_wait = self.max_wait if self.max_wait is not None else self.graph_map.width + self.graph_map.height
+        max_time = int(steps[start]) + max_wait
+        # the robot can only park at the goal after all robots planned before passed it
+        arrival = self._last.get(goal, -1) + 1
+        parent = {(start, 0): None}
+        # among equal estimates the later state is expanded first, it is closer to the goal
+        open_list = [(steps[start], 0, start)]
+        while open_list:
+            _, t, v = heapq.heappop(open_list)
+            t = -t
+            if v == goal and t >= arrival:
+                path = []
+                state = (v, t)
+                while state is not None:
+                    path.append(state[0])
+                    state = parent[state]
+                return path[::-1]
+            if t >= max_time:
+                continue
+            for w in [v] + neighbors[v].tolist():
+                if (w, t + 1) in parent or np.isinf(steps[w]) or self._blocked(v, w, t):
+                    continue
+                parent[(w, t + 1)] = (v, t)
+                heapq.heappush(open_list, (t + 1 + steps[w], -(t + 1), w))
+        return None
+
+
+class DStarLite:
+    """Incremental planner (D* Lite) on a GraphMap for a robot moving towards a fixed goal.
+    
+    The search runs backwards from the goal, so when the robot moves or obstacles are added, moved or
+    removed through the GraphMap only the affected part of the previous search is repaired instead of
+    planning from scratch. Changes of the graph are picked up from GraphMap.changes on the next call of
+    path(), a full rebuild of the graph restarts the search.
+    """
+    def __init__(self, graph_map, start, goal):
+        self.graph_map = graph_map
+        self.goal = goal
+        self.goal_index = graph_map.node_index(goal)
+        self.start_index = graph_map.node_index((round(start[0]), round(start[1])))
+        self._reset()
+    
+    def _reset(self):
+        n = self.graph_map.graph.shape[0]
+        self._graph_version = self.graph_map.graph_version
+        self.km = 0.0
+        self.g = [math.inf] * n
+        self.rhs = [math.inf] * n
+        self.rhs[self.goal_index] = 0.0
+        # open list as heap with lazy deletion, _open maps the queued nodes to their current key
+        self._open = {}
+        self._heap = []
+        self._push(self.goal_index)
+    
+    def _heuristic(self, a, b):
+        height = self.graph_map.height
+        dx = abs(a // height - b // height)
+        dy = abs(a % height - b % height)
+        return dx + dy + (math.sqrt(2) - 2) * min(dx, dy)
+    
+    def _key(self, v):
+        k = min(self.g[v], self.rhs[v])
+        # keys are sums of path costs, heuristic and km in varying order, rounding makes
+        # keys that are equal up to floating point errors compare equal
+        return (round(k + self._heuristic(self.start_index, v) + self.km, 9), round(k, 9))
+    
+    def _push(self, v):
+        key = self._key(v)
+        self._open[v] = key
+        heapq.heappush(self._heap, (key, v))
+    
+    def _top_key(self):
+        while self._heap:
+            key, v = self._heap[0]
+            if self._open.get(v) == key:
+                return key
+            heapq.heappop(self._heap)  # outdated entry
+        return (math.inf, math.inf)
+    
+    def _neighbors(self, v):
+        graph = self.graph_map.graph
+        a, b = graph.indptr[v], graph.indptr[v + 1]
+        return zip(graph.indices[a:b].tolist(), graph.data[a:b].tolist())
+    
+    def _update_vertex(self, v):
+        g = self.g
+        if v != self.goal_index:
+            best = math.inf
+            for w, cost in self._neighbors(v):
+                if cost + g[w] < best:
+                    best = cost + g[w]
+            self.rhs[v] = best
+        self._open.pop(v, None)
+        if g[v] != self.rhs[v]:
+            self._push(v)
+    
+    def _compute_shortest_path(self):
+        g, rhs = self.g, self.rhs
+        start = self.start_index
+        while self._top_key() < self._key(start) or rhs[start] != g[start]:
+            key, v = heapq.heappop(self._heap)
+            if key == (math.inf, math.inf):
+                break
+            del self._open[v]
+            if key < self._key(v):
+                self._push(v)
+            elif g[v] > rhs[v]:
+                g[v] = rhs[v]
+                for w, _ in self._neighbors(v):
+                    self._update_vertex(w)
+            else:
+                g[v] = math.inf
+                self._update_vertex(v)
+                for w, _ in self._neighbors(v):
+                    self._update_vertex(w)
+    
+    def _sync_graph(self):
+        """ Repair the search for the graph changes since the last call """
+        version = self.graph_map.graph_version
+        if version == self._graph_version:
+            return
+        changes = [nodes for v, nodes in self.graph_map.changes if v > self._graph_version]
+        if len(changes) != version - self._graph_version:
+            # full rebuild or changes no longer logged
+            self._reset()
+            return
+        for nodes in changes:
+            for v in nodes.tolist():
+                self._update_vertex(v)
+        self._graph_version = version
+    
+    def move_to(self, position):
+        """ Update the position of the robot """
+        start_index = self.graph_map.node_index((round(position[0]), round(position[1])))
+        self.km += self._heuristic(self.start_index, start_index)
+        self.start_index = start_index
+    
+    def path(self):
+        """ Shortest path from the current position to the goal as list of grid points """
+        self.graph_map.refresh()
+        self._sync_graph()
+        self._compute_shortest_path()
+        
+        start = self.graph_map.node_coord(self.start_index)
+        if math.isinf(self.g[self.start_index]):
+            raise ValueError(f"No connection from {start} to {self.goal}")
+        
+        g = self.g
+        path = [self.start_index]
+        v = self.start_index
+        while v != self.goal_index:
+            v = min(self._neighbors(v), key=lambda e: e[1] + g[e[0]])[0]
+            path.append(v)
+        return [self.graph_map.node_coord(node) for node in path]
+        
+        
 ### End of pathfinding by discretisizing the map into a graph ###
 
+### Pathfinding on the visibility graph of the obstacle corners ###
+
+class VisibilityGraphPlanner:
+    """Shortest any-angle paths over the corners of the obstacles inflated by robot_radius.
+
+    Around axis-aligned rectangles a shortest path only bends at corners, so the graph of the mutually
+    visible corners (built once per map version) gives exact shortest paths from a few nodes. Start and
+    goal are connected to the corners they see per query. The corners are moved outwards by MARGIN,
+    paths along the sides of an obstacle do not touch it. With robot_radius > 0 the obstacles are
+    inflated to larger rectangles, the paths keep the distance but are slightly longer around corners.
+    """
+    MARGIN = 1e-6
+
+    def __init__(self, map: Map, robot_radius=0.0):
+        self.map = map
+        self.robot_radius = robot_radius
+        self._map_version = None
+
+    def refresh(self):
+        """ Rebuild the corner graph if the map changed """
+        if self._map_version == self.map.version:
+            return
+        r = self.robot_radius
+        self.bounds = self.map.obstacle_bounds() + np.array([-r, -r, r, r])
+        b = self.bounds + np.array([-1, -1, 1, 1]) * self.MARGIN
+        corners = np.concatenate((b[:, [0, 1]], b[:, [0, 3]], b[:, [2, 1]], b[:, [2, 3]]))
+        # direction from the obstacle to its corner, (1, 1) for the upper right one
+        sides = np.repeat([[-1, -1], [-1, 1], [1, -1], [1, 1]], len(b), axis=0)
+        # corners beyond the walls or inside other obstacles are never on a path
+        x, y = corners.T
+        keep = (x >= r) & (x <= self.map.width - 1 - r) & (y >= r) & (y <= self.map.height - 1 - r)
+        keep &= ~segments_in_rectangles(x, y, x, y, self.bounds)
+        self.corners, self.sides = corners[keep], sides[keep]
+
+        # visibility of the pairs of corners, the corners after i are tested against corner i in one call.
+        # Only pairs tangent at both corners can be part of a shortest path and are tested at all
+        u, v = [], []
+        for i in range(len(self.corners) - 1):
+            later = np.arange(i + 1, len(self.corners))
+            later = later[self._tangent(i, self.corners[later]) & self._tangent(later, self.corners[i])]
+            visible = ~segments_in_rectangles(*self.corners[i], self.corners[later, 0], self.corners[later, 1], self.bounds)
+            u.append(np.full(visible.sum(), i))
+            v.append(later[visible])
+        self.edges = np.stack((np.concatenate(u or [[]]), np.concatenate(v or [[]])), axis=1).astype(np.int64)
+        self.lengths = np.hypot(*(self.corners[self.edges[:, 1]] - self.corners[self.edges[:, 0]]).T)
+        self._map_version = self.map.version
+
+    def _tangent(self, corners, points):
+        """ Whether the lines from the corners to the points do not cut into the obstacles of the corners """
+        d = points - self.corners[corners]
+        return d[..., 0] * d[..., 1] * self.sides[corners, 0] * self.sides[corners, 1] <= 0
+
+    def blocked(self, point):
+        """ Whether the robot can not stand at point: outside of the map or in an inflated obstacle """
+        x, y = point
+        r = self.robot_radius
+        if not (r <= x <= self.map.width - 1 - r and r <= y <= self.map.height - 1 - r):
+            return True
+        return bool(segments_in_rectangles(x, y, x, y, self.bounds))
+
+    def path_from_to(self, start, goal):
+        """ Shortest path from start to goal as a list of points, raises ValueError if there is none """
+        self.refresh()
+        if self.blocked(start) or self.blocked(goal):
+            raise ValueError("Start or goal is not free")
+        start, goal = (float(start[0]), float(start[1])), (float(goal[0]), float(goal[1]))
+        if not segments_in_rectangles(*start, *goal, self.bounds):
+            return [start, goal]
+
+        # start and goal become the nodes n and n + 1, connected to the corners they see
+        n = len(self.corners)
+        ends = np.array([start, goal])
+        end_nodes, corner_nodes = np.nonzero(self._tangent(np.arange(n), ends[:, None, :]))
+        visible = ~segments_in_rectangles(ends[end_nodes, 0], ends[end_nodes, 1], self.corners[corner_nodes, 0],
+                                          self.corners[corner_nodes, 1], self.bounds)
+        end_nodes, corner_nodes = end_nodes[visible], corner_nodes[visible]
+        u = np.concatenate((self.edges[:, 0], n + end_nodes))
+        v = np.concatenate((self.edges[:, 1], corner_nodes))
+        lengths = np.concatenate((self.lengths, np.hypot(*(self.corners[corner_nodes] - ends[end_nodes]).T)))
+        # the tiny offset keeps edges of length 0 (start or goal on a corner) in the sparse graph
+        graph = sp.csr_matrix((lengths + 1e-12, (u, v)), shape=(n + 2, n + 2))
+        dist, pred = csg.dijkstra(graph, directed=False, indices=n, return_predecessors=True)
+        if np.isinf(dist[n + 1]):
+            raise ValueError("No path found")
+
+        path = [goal]
+        node = pred[n + 1]
+        while node != n:
+            path.append(tuple(self.corners[node].tolist()))
+            node = pred[node]
+        path.append(start)
+        path.reverse()
+        return path
+
+    def instructions_from_path(self, path):
+        """ Relative moves (dx, dy) between the points of the path, as taken by RobotManager.resolve_path """
+        return [(q[0] - p[0], q[1] - p[1]) for p, q in zip(path, path[1:])]
+
+### End of pathfinding on the visibility graph ###
+
+### Compiled maps ###
+
+# format of the compiled map bundles, bundles of another format are compiled again
+BUNDLE_VERSION = 1
+
+
+def map_hash(map, robot_radius=0.0, clearance_cost=0.0, clearance_range=1.0):
+    """ Content hash of the map definition and the graph parameters, the key of a compiled bundle """
+    definition = dict(map.to_dict(), resolution=map.resolution, robot_radius=robot_radius,
+                      clearance_cost=clearance_cost, clearance_range=clearance_range, version=BUNDLE_VERSION)
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+
+def compile_map(map, directory="compiled_maps", robot_radius=0.0, clearance_cost=0.0, clearance_range=1.0):
+    """ Compute the derived data of the map and write it as bundle directory/map_<hash>.npz, returns the path.
+    
+    The bundle holds the map definition, the occupancy and clearance rasters, the CSR graph with its
+    component labels, the flow fields towards all seats and the ALT landmark table.
+    """
+    key = map_hash(map, robot_radius, clearance_cost, clearance_range)
+    graph_map = GraphMap(map, robot_radius, clearance_cost, clearance_range)
+    flow_fields = FlowFieldCache(graph_map)
+    flow_fields.precompute()
+    seats = [(round(s.x), round(s.y)) for s in map.seats]
+    fields = [flow_fields.field(seat) for seat in seats]
+    landmarks = Landmarks(graph_map)
+    landmarks.update()
+    labels, _ = graph_map.components()
+    shape = (len(seats), graph_map.width, graph_map.height)
+    
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"map_{key[:16]}.npz")
+    # uncompressed, so loading is a plain read of the arrays
+    np.savez(path, version=BUNDLE_VERSION, hash=key, definition=json.dumps(map.to_dict()),
+             raster=map.occupancy_raster(), clearance=map.clearance(),
+             indptr=graph_map.graph.indptr, indices=graph_map.graph.indices, data=graph_map.graph.data,
+             labels=labels, seat_nodes=np.array([graph_map.node_index(seat) for seat in seats], dtype=np.int64),
+             seat_dist=np.array([dist for dist, _ in fields], dtype=np.float32).reshape(shape),
+             seat_direction=np.array([direction for _, direction in fields], dtype=np.int8).reshape(shape),
+             landmark_nodes=landmarks.nodes, landmark_distances=landmarks.distances)
+    return path
+
+
+def load_compiled_map(map, directory="compiled_maps", robot_radius=0.0, clearance_cost=0.0, clearance_range=1.0):
+    """ GraphMap and seat FlowFieldCache of the map, read from its compiled bundle instead of computed.
+    
+    The bundle is compiled first if there is none for the current content of the map. The rasters of the
+    map itself (used by OccupationMap.from_Map as well) are filled from the bundle too.
+    """
+    key = map_hash(map, robot_radius, clearance_cost, clearance_range)
+    path = os.path.join(directory, f"map_{key[:16]}.npz")
+    if not os.path.exists(path):
+        compile_map(map, directory, robot_radius, clearance_cost, clearance_range)
+    with np.load(path) as bundle:
+        if int(bundle["version"]) != BUNDLE_VERSION or str(bundle["hash"]) != key:
+            compile_map(map, directory, robot_radius, clearance_cost, clearance_range)
+            return load_compiled_map(map, directory, robot_radius, clearance_cost, clearance_range)
+        arrays = {name: bundle[name] for name in bundle.files}
+    
+    map.set_rasters(arrays["raster"], arrays["clearance"])
+    n = map.width * map.height
+    graph = sp.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=(n, n))
+    graph_map = GraphMap(map, robot_radius, clearance_cost, clearance_range, graph=graph, components=arrays["labels"])
+    graph_map.landmarks = Landmarks(graph_map, nodes=arrays["landmark_nodes"], distances=arrays["landmark_distances"])
+    
+    flow_fields = FlowFieldCache(graph_map)
+    seats = [graph_map.node_coord(i) for i in arrays["seat_nodes"].tolist()]
+    flow_fields.load_fields(seats, arrays["seat_dist"], arrays["seat_direction"])
+    return graph_map, flow_fields
+
+### End of compiled maps ###
@@ -0,0 +1,293 @@
+import argparse
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from pathfinding import (RRT, CooperativePlanner, GraphMap, Map, Obstacle, ParallelRRT, ProbabilisticRoadmap, Seat,
+                         VisibilityGraphPlanner)
+
+MAP_SIZES = [(22, 14), (50, 50), (100, 100), (200, 200), (500, 500)]
+
+# floor plans of the benchmark suite: (width, height, table density, seats)
+FLOOR_PLANS = [(22, 14, 0.15, 4), (50, 50, 0.2, 16), (100, 100, 0.2, 40), (200, 200, 0.25, 100)]
+QUERY_METHODS = ["dijkstra", "astar", "alt", "jps", "hpa", "tree", "time"]
+
+
+def random_map(width, height, num_obstacles, seed=0):
+    """ Map with randomly placed rectangular obstacles (tables) """
+    rng = random.Random(seed)
+    obstacles = []
+    for _ in range(num_obstacles):
+        w = rng.randint(1, min(8, max(1, width // 10)))
+        h = rng.randint(1, min(8, max(1, height // 10)))
+        obstacles.append(Obstacle(rng.randint(0, width - w), rng.randint(0, height - h), w, h))
+    return Map(width, height, obstacles, [])
+
+
+def restaurant_map(width, height, density=0.2, num_seats=10, seed=0, aisle=3):
+    """ Restaurant-like floor plan: tables in rows and columns separated by aisles, seats next to the tables.
+
+    density is the approximate fraction of the floor covered by tables, aisle the minimal free space
+    between two tables (in cells). Tables are placed on a jittered grid with random sizes, seats
+    on free grid points directly beside a table.
+    """
+    rng = random.Random(seed)
+    # table cells of size (table + aisle)^2 covering the floor with the requested density
+    table = max(1, round(aisle * density ** 0.5 / (1 - density ** 0.5)))
+    pitch = table + aisle
+    obstacles = []
+    for x0 in range(aisle, width - table - 1, pitch):
+        for y0 in range(aisle, height - table - 1, pitch):
+            w = rng.randint(max(1, table - 1), table + 1)
+            h = rng.randint(max(1, table - 1), table + 1)
+            x = min(x0 + rng.randint(0, 1), width - w - 1)
+            y = min(y0 + rng.randint(0, 1), height - h - 1)
+            obstacles.append(Obstacle(x, y, w, h))
+    map = Map(width, height, obstacles, [])
+
+    # candidate seats: free points right beside the long sides of the tables
+    candidates = []
+    for o in obstacles:
+        for x in range(o.x, o.x + o.width + 1):
+            candidates += [(x, o.y - 1), (x, o.y + o.height + 1)]
+    candidates = [p for p in set(candidates) if map.in_map(*p) and not map.in_obstacle(*p)]
+    candidates.sort()
+    rng.shuffle(candidates)
+    map.seats = [Seat(i, x, y) for i, (x, y) in enumerate(candidates[:num_seats])]
+    return map
+
+
+def random_free_point(map, rng, near=None, radius=None):
+    """ Random grid point outside of the obstacles, optionally within radius cells of near """
+    while True:
+        if near is None:
+            x, y = rng.randrange(map.width), rng.randrange(map.height)
+        else:
+            x = min(max(near[0] + rng.randint(-radius, radius), 0), map.width - 1)
+            y = min(max(near[1] + rng.randint(-radius, radius), 0), map.height - 1)
+        if not map.in_obstacle(x, y):
+            return (x, y)
+
+
+def time_queries(graph_map, queries, method):
+    """ Mean query time in ms, queries without connection are counted as well """
+    t = time.perf_counter()
+    for start, goal in queries:
+        try:
+            graph_map.path_from_to(start, goal, method=method)
+        except ValueError:
+            pass
+    return (time.perf_counter() - t) / len(queries) * 1000
+
+
+def benchmark_astar(sizes=MAP_SIZES, num_queries=20, seed=0):
+    """ Compare A* and Dijkstra query latency on random maps for nearby and far apart start/goal pairs """
+    rng = random.Random(seed)
+    results = []
+    for width, height in sizes:
+        map = random_map(width, height, num_obstacles=(width * height) // 200, seed=seed)
+        graph_map = GraphMap(map)
+
+        near, far = [], []
+        for _ in range(num_queries):
+            start = random_free_point(map, rng)
+            near.append((start, random_free_point(map, rng, near=start, radius=3)))
+            far.append((start, random_free_point(map, rng)))
+
+        # first A* query allocates the search state
+        graph_map.path_from_to(*near[0], method="astar")
+
+        for name, queries in (("near", near), ("far", far)):
+            result = {
+                "size": f"{width}x{height}",
+                "queries": name,
+                "dijkstra_ms": time_queries(graph_map, queries, "dijkstra"),
+                "astar_ms": time_queries(graph_map, queries, "astar"),
+            }
+            results.append(result)
+            print(f"{result['size']:>8} {name:>5}: dijkstra {result['dijkstra_ms']:8.3f} ms"
+                  f"   astar {result['astar_ms']:8.3f} ms")
+    return results
+
+
+def measure_build(map, repeats=3):
+    """ Best GraphMap construction time in ms, peak traced memory of one construction in bytes and the graph """
+    build_ms = min(_timed(GraphMap, map)[1] for _ in range(repeats))
+    tracemalloc.start()
+    graph_map = GraphMap(map)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return build_ms, peak, graph_map
+
+
+def measure_queries(graph_map, queries, methods=QUERY_METHODS):
+    """ Mean query latency in ms per method, the first query of a method (allocations, caches) is timed separately """
+    results = {}
+    for method in methods:
+        first_ms = _timed(_query, graph_map, *queries[0], method)[1]
+        results[method] = {"first_ms": first_ms, "mean_ms": time_queries(graph_map, queries, method)}
+    return results
+
+
+def measure_rrt(map, start, goal, iterations=(500, 1000, 2000, 5000), seed=0):
+    """ RRT* run time and path length for increasing iteration budgets """
+    results = []
+    for maxiter in iterations:
+        random.seed(seed)
+        rrt = RRT(map, maxiter=maxiter)
+        (path, nodes), ms = _timed(rrt.rrt_star, start, goal)
+        length = None
+        if path is not None:
+            length = sum(rrt.distance(path[i], path[i + 1]) for i in range(len(path) - 1))
+        results.append({"iterations": maxiter, "time_ms": ms, "nodes": len(nodes), "path_length": length})
+    return results
+
+
+def measure_parallel_rrt(map, start, goal, workers=(1, 2, 4, 8), maxiter=2000, seed=0):
+    """ Best-of-N RRT* with one search per worker: wall time and best path length per worker count.
+
+    The pool start (fork, map transfer) is timed separately from the query.
+    """
+    results = []
+    for n in workers:
+        planner = ParallelRRT(map, workers=n, maxiter=maxiter)
+        try:
+            startup_ms = _timed(planner._ensure_pool)[1]
+            (path, length), ms = _timed(planner.rrt_star, start, goal, None, seed)
+        finally:
+            planner.close()
+        results.append({"workers": n, "startup_ms": startup_ms, "time_ms": ms,
+                        "path_length": length if path is not None else None})
+    return results
+
+
+def measure_prm(map, queries, samples=2000, connect_rad=4.0, seed=0):
+    """ Roadmap build time and query latency in ms of the lazy PRM, the second pass shows the effect of the stored edge checks """
+    roadmap, build_ms = _timed(ProbabilisticRoadmap, map, samples, connect_rad, 0.0, seed)
+    first = _timed(_planner_queries, roadmap, queries)[1]
+    second = _timed(_planner_queries, roadmap, queries)[1]
+    return {"samples": samples, "edges": len(roadmap.edges), "build_ms": build_ms,
+            "first_pass_ms": first / len(queries), "mean_ms": second / len(queries)}
+
+
+def measure_visibility(map, queries):
+    """ Corner graph build time and mean query latency in ms of the visibility graph planner """
+    planner = VisibilityGraphPlanner(map)
+    build_ms = _timed(planner.refresh)[1]
+    query_ms = _timed(_planner_queries, planner, queries)[1]
+    return {"corners": len(planner.corners), "edges": len(planner.edges), "build_ms": build_ms,
+            "mean_ms": query_ms / len(queries)}
+
+
+def measure_cooperative(map, robot_counts=(1, 5, 10, 20), seed=0):
+    """ Planning time of the cooperative planner for increasing numbers of robots with random distinct starts and goals """
+    rng = random.Random(seed)
+    graph_map = GraphMap(map)
+    results = []
+    for robots in robot_counts:
+        points = []
+        while len(points) < 2 * robots:
+            point = random_free_point(map, rng)
+            if point not in points:
+                points.append(point)
+        try:
+            paths, ms = _timed(CooperativePlanner(graph_map).plan, points[:robots], points[robots:])
+            makespan = max(len(path) for path in paths) - 1
+        except ValueError:
+            ms, makespan = None, None
+        results.append({"robots": robots, "time_ms": ms, "makespan": makespan})
+    return results
+
+
+def run_suite(floor_plans=FLOOR_PLANS, num_queries=20, rrt_iterations=(500, 1000, 2000, 5000),
+              rrt_max_size=100, seed=0):
+    """ Benchmark all floor plans, returns a JSON serializable dict.
+
+    RRT* is only run on maps up to rrt_max_size cells wide and high since it does not scale to the large ones.
+    """
+    rng = random.Random(seed)
+    runs = []
+    for width, height, density, num_seats in floor_plans:
+        map = restaurant_map(width, height, density, num_seats, seed=seed)
+        build_ms, peak, graph_map = measure_build(map)
+        graph = graph_map.graph
+
+        # queries from random points to the seats, like the robot delivering from anywhere
+        seats = [(s.x, s.y) for s in map.seats]
+        queries = [(random_free_point(map, rng), rng.choice(seats)) for _ in range(num_queries)]
+
+        run = {
+            "width": width,
+            "height": height,
+            "density": density,
+            "seats": len(seats),
+            "obstacles": len(map.obstacles),
+            "nodes": graph.shape[0],
+            "edges": graph.nnz,
+            "build_ms": build_ms,
+            "build_peak_bytes": peak,
+            "graph_bytes": graph.data.nbytes + graph.indices.nbytes + graph.indptr.nbytes,
+            "queries": measure_queries(graph_map, queries),
+        }
+        if max(width, height) <= rrt_max_size:
+            run["rrt_star"] = measure_rrt(map, *queries[0], iterations=rrt_iterations, seed=seed)
+            run["parallel_rrt"] = measure_parallel_rrt(map, *queries[0], seed=seed)
+            run["prm"] = measure_prm(map, queries, seed=seed)
+            run["visibility"] = measure_visibility(map, queries)
+        runs.append(run)
+
+        query_summary = "  ".join(f"{m} {r['mean_ms']:.3f} ms" for m, r in run["queries"].items())
+        print(f"{width:>4}x{height:<4} build {build_ms:8.2f} ms  {query_summary}")
+
+    cooperative = measure_cooperative(restaurant_map(100, 100, 0.2, 0, seed=seed), seed=seed)
+    print("cooperative 100x100  " + "  ".join(f"{r['robots']} robots {r['time_ms']:.1f} ms"
+                                             for r in cooperative if r["time_ms"] is not None))
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": seed,
+        "runs": runs,
+        "cooperative": cooperative,
+    }
+
+
+def _timed(function, *args):
+    t = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - t) * 1000
+
+
+def _planner_queries(planner, queries):
+    for start, goal in queries:
+        try:
+            planner.path_from_to(start, goal)
+        except ValueError:
+            pass
+
+
+def _query(graph_map, start, goal, method):
+    try:
+        return graph_map.path_from_to(start, goal, method=method)
+    except ValueError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the path planners on synthetic restaurant floor plans")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--queries", type=int, default=20, help="path queries per floor plan")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--astar", action="store_true", help="only run the A* vs Dijkstra comparison on random maps")
+    args = parser.parse_args()
+
+    if args.astar:
+        benchmark_astar(num_queries=args.queries, seed=args.seed)
+    else:
+        results = run_suite(num_queries=args.queries, seed=args.seed)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
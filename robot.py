@@ -36,7 +36,8 @@ class RobotManager:
         o1 = Obstacle(10, 0, 4, 4)
         map = Map(22, 14, [o1], [])
 
-        graphMap = GraphMap(map)
+        # graph, rasters and seat flow fields are read from the compiled map bundle (compiled on first start)
+        self.graph_map, self.flow_fields = load_compiled_map(map)
 
         self.map = map
         self.ep_camera = self.ep_robot.camera
@@ -102,12 +103,37 @@ class RobotManager:
                 target_angle = -(math.degrees(math.atan2(dy, dx)) + 360) % 360
                 if target_angle > 180:
                     target_angle -= 360  # Make angle negative if greater than 180
-            self.rotate_angle(target_angle-self.current_angle)
+            # turn the shorter way round, estimate_execution_time assumes the same
+            self.rotate_angle((target_angle - self.current_angle + 180) % 360 - 180)
             self.current_angle =  target_angle
-            if dx + dy >= 2:
-                self.move_distance("forward", 14.14 )
-            else:
-                self.move_distance("forward", 10)
+            # one grid cell is 10 cm, instructions of compressed paths span several cells
+            self.move_distance("forward", math.hypot(dx, dy) * 10)
+
+    def resolve_path_holonomic(self, path_instructions):
+        """Drive each (dx, dy) instruction as one straight move without rotating.
+
+        The mecanum wheels combine the forward and sideways motion, both components are
+        scaled so that they finish at the same time. Meant for compressed paths
+        (GraphMap.instructions_from_path(path, compress=True)).
+        """
+        if not self.ep_robot:
+            print("Robot not initialized.")
+            return
+        for dx, dy in path_instructions:
+            # map frame -> robot frame, current_angle > 0 means the robot is turned right
+            angle = math.radians(self.current_angle)
+            forward = (dx * math.cos(angle) - dy * math.sin(angle)) * 10
+            left = (dx * math.sin(angle) + dy * math.cos(angle)) * 10
+            t_forward, t_left = strafe_times(forward, left)
+            duration = max(t_forward, t_left)
+            if duration == 0:
+                continue
+            vx = math.copysign(50 * t_forward / duration, forward)
+            vy = math.copysign(50 * t_left / duration, left)
+            w1, w2 = round(vx + vy), round(vx - vy)
+            self.ep_chassis.drive_wheels(w1=w1, w2=w2, w3=w1, w4=w2)
+            time.sleep(duration)
+            self.stop()
 
 
 